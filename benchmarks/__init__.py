@@ -0,0 +1,127 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+"""doublex benchmarks. Run them with:
+
+    python -m benchmarks -o results.json
+    python -m benchmarks --compare base.json results.json
+
+Each benchmark is a function registered with @benchmark(name, ops) that
+builds the fixtures and returns the callable to time. 'ops' is the number
+of operations done by each call, so results are given per operation.
+Functions registered with @memory_benchmark(name, ops) are measured with
+tracemalloc instead: the bytes still allocated after a single call.
+"""
+
+import json
+import platform
+import re
+import time
+import timeit
+import tracemalloc
+
+
+BENCHMARKS = []
+MEMORY_BENCHMARKS = []
+
+
+def benchmark(name, ops=1):
+    def decorator(setup):
+        BENCHMARKS.append((name, ops, setup))
+        return setup
+    return decorator
+
+
+def memory_benchmark(name, ops=1):
+    def decorator(setup):
+        MEMORY_BENCHMARKS.append((name, ops, setup))
+        return setup
+    return decorator
+
+
+def measure_memory(func, ops):
+    "bytes per operation allocated (and not freed) by func"
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        retained = func()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    del retained
+    return (after - before) / ops
+
+
+def measure(func, ops, repeat=5, min_time=0.1):
+    "best time per operation of 'repeat' runs lasting 'min_time' at least"
+    timer = timeit.Timer(func, timer=time.perf_counter)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 0.2)))
+    best = min(timer.repeat(repeat, number))
+    return best / number / ops
+
+
+def run(pattern=None, repeat=5, min_time=0.1, report=print):
+    from . import cases, memory
+
+    results = {}
+    for name, ops, setup in BENCHMARKS:
+        if pattern and not re.search(pattern, name):
+            continue
+
+        per_op = measure(setup(), ops, repeat, min_time)
+        results[name] = dict(seconds_per_op=per_op, ops=ops)
+        report("%-40s %12.2f us/op" % (name, per_op * 1e6))
+
+    for name, ops, setup in MEMORY_BENCHMARKS:
+        if pattern and not re.search(pattern, name):
+            continue
+
+        per_op = measure_memory(setup(), ops)
+        results[name] = dict(bytes_per_op=per_op, ops=ops)
+        report("%-40s %12.0f bytes/op" % (name, per_op))
+
+    return dict(python=platform.python_version(),
+                implementation=platform.python_implementation(),
+                doublex=doublex_version(),
+                results=results)
+
+
+def doublex_version():
+    try:
+        from doublex._version import version
+        return version
+    except ImportError:
+        return None
+
+
+def load(fname):
+    with open(fname) as fd:
+        return json.load(fd)
+
+
+def compare(base, current, threshold=1.2, report=print):
+    """Ratio current/base per benchmark. Returns the names of the benchmarks
+    slower than 'threshold' times the base."""
+    regressions = []
+    base, current = base['results'], current['results']
+    for name in sorted(set(base) & set(current)):
+        if 'bytes_per_op' in base[name]:
+            metric, scale, unit = 'bytes_per_op', 1, 'bytes/op'
+        else:
+            metric, scale, unit = 'seconds_per_op', 1e6, 'us/op'
+
+        ratio = current[name][metric] / base[name][metric]
+        mark = ''
+        if ratio > threshold:
+            regressions.append(name)
+            mark = '  REGRESSION'
+
+        report("%-40s %12.2f -> %12.2f %s  x%.2f%s" % (
+            name, base[name][metric] * scale,
+            current[name][metric] * scale, unit, ratio, mark))
+
+    for name in sorted(set(base) ^ set(current)):
+        report("%-40s only in %s" % (name, 'base' if name in base else 'current'))
+
+    return regressions
@@ -0,0 +1,39 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+import argparse
+import json
+import sys
+
+from . import run, load, compare
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks', description='doublex benchmarks')
+    parser.add_argument('-k', dest='pattern',
+                        help='run only benchmarks whose name matches this regex')
+    parser.add_argument('-o', '--output', help='write results to this JSON file')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help='minimum seconds per repetition')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'CURRENT'),
+                        help='compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio reported as regression (--compare)')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        regressions = compare(load(args.compare[0]), load(args.compare[1]),
+                              args.threshold)
+        return 1 if regressions else 0
+
+    results = run(args.pattern, args.repeat, args.min_time)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
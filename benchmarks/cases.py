@@ -0,0 +1,307 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+import copy
+import random
+import threading
+
+from hamcrest import assert_that
+
+from doublex import (Stub, Spy, ProxySpy, Mock, Mimic, Tracer, called,
+                     verify, any_order_verify, wait_that, set_recording_policy,
+                     RecordingPolicy, SnapshotPolicy, CompactOperationList,
+                     DiskOperationList, set_recording_storage)
+
+from . import benchmark
+
+
+class Collaborator(object):
+    def __init__(self):
+        self._value = 1
+
+    def hello(self, name):
+        return "hello %s" % name
+
+    def add(self, a, b=0):
+        return a + b
+
+    def get_value(self):
+        return self._value
+
+    def set_value(self, value):
+        self._value = value
+
+    value = property(get_value, set_value)
+
+
+# construction
+
+@benchmark('construct.stub')
+def construct_stub():
+    return lambda: Stub(Collaborator)
+
+
+@benchmark('construct.spy')
+def construct_spy():
+    return lambda: Spy(Collaborator)
+
+
+@benchmark('construct.proxyspy')
+def construct_proxyspy():
+    collaborator = Collaborator()
+    return lambda: ProxySpy(collaborator)
+
+
+@benchmark('construct.mock')
+def construct_mock():
+    return lambda: Mock(Collaborator)
+
+
+@benchmark('construct.mimic')
+def construct_mimic():
+    return lambda: Mimic(Spy, Collaborator)
+
+
+# dispatch
+
+def stub_with(nstubs):
+    with Stub(Collaborator) as stub:
+        for i in range(nstubs):
+            stub.add(i).returns(i)
+
+    return stub
+
+
+def dispatch(nstubs):
+    stub = stub_with(nstubs)
+    return lambda: stub.add(0)
+
+
+def dispatch_uncached(nstubs):
+    stub = stub_with(nstubs)
+    return lambda: stub.add(0, b=[])
+
+
+for nstubs in (1, 100, 10000):
+    benchmark('dispatch.stubs_%s' % nstubs)(
+        lambda nstubs=nstubs: dispatch(nstubs))
+    benchmark('dispatch.uncached.stubs_%s' % nstubs)(
+        lambda nstubs=nstubs: dispatch_uncached(nstubs))
+
+
+@benchmark('dispatch.free_stub')
+def dispatch_free_stub():
+    with Stub() as stub:
+        stub.foo(1).returns(2)
+
+    return lambda: stub.foo(1)
+
+
+@benchmark('dispatch.proxyspy')
+def dispatch_proxyspy():
+    spy = ProxySpy(Collaborator())
+    return lambda: spy.hello('bob')
+
+
+# recording
+
+@benchmark('record.spy', ops=1000)
+def record_spy():
+    def record():
+        spy = Spy(Collaborator)
+        for i in range(1000):
+            spy.add(i)
+
+    return record
+
+
+@benchmark('record.free_spy', ops=1000)
+def record_free_spy():
+    def record():
+        spy = Spy()
+        for i in range(1000):
+            spy.foo(i)
+
+    return record
+
+
+@benchmark('record.compact_spy', ops=1000)
+def record_compact_spy():
+    def record():
+        spy = Spy()
+        set_recording_storage(spy, CompactOperationList())
+        for i in range(1000):
+            spy.incr("requests")
+
+    return record
+
+
+@benchmark('record.disk_spy', ops=1000)
+def record_disk_spy():
+    def record():
+        spy = Spy()
+        set_recording_storage(spy, DiskOperationList())
+        for i in range(1000):
+            spy.foo(i)
+
+    return record
+
+
+# snapshot on record: cost of a spy call per argument copy strategy
+
+class Message(object):
+    def __init__(self, body):
+        self.body = body
+
+
+SNAPSHOT_ARGUMENTS = dict(
+    flat=lambda: list(range(100)),
+    nested=lambda: dict(ids=list(range(50)), tags=['a', 'b'], key=('x', 1)),
+    deepcopy=lambda: Message(list(range(100))))
+
+
+def snapshot_call(argument, policy):
+    spy = Spy()
+    if policy is not None:
+        set_recording_policy(spy, policy)
+
+    value = SNAPSHOT_ARGUMENTS[argument]()
+    return lambda: spy.send(value)
+
+
+for argument in SNAPSHOT_ARGUMENTS:
+    benchmark('snapshot.%s.reference' % argument)(
+        lambda argument=argument: snapshot_call(argument, None))
+    benchmark('snapshot.%s.copy' % argument)(
+        lambda argument=argument: snapshot_call(
+            argument, SnapshotPolicy(deepcopy_types=[Message])))
+
+
+
+class DeepCopyPolicy(RecordingPolicy):
+    "copy.deepcopy() of all the arguments, for reference"
+    def capture(self, context):
+        return copy.deepcopy((context.args, context.kargs))
+
+    def record(self, context, captured=None):
+        if captured is not None:
+            context.args, context.kargs = captured
+
+
+for argument in SNAPSHOT_ARGUMENTS:
+    benchmark('snapshot.%s.deepcopy_all' % argument)(
+        lambda argument=argument: snapshot_call(argument, DeepCopyPolicy()))
+
+
+@benchmark('verify.compact.called_times.history_10000')
+def compact_called_times():
+    spy = Spy()
+    set_recording_storage(spy, CompactOperationList())
+    for i in range(10000):
+        spy.foo(i % 10)
+
+    return lambda: assert_that(spy.foo, called().times(10000))
+
+
+# verification
+
+@benchmark('verify.called_with_args.history_10000')
+def called_with_args():
+    spy = Spy(Collaborator)
+    for i in range(10000):
+        spy.add(i)
+
+    return lambda: assert_that(spy.add, called().with_args(9999))
+
+
+@benchmark('verify.called_times.history_10000')
+def called_times():
+    spy = Spy()
+    for i in range(10000):
+        spy.foo(i % 10)
+
+    return lambda: assert_that(spy.foo, called().times(10000))
+
+
+def mock_with(ncalls):
+    with Mock(Collaborator) as mock:
+        for i in range(ncalls):
+            mock.add(i)
+
+    return mock
+
+
+@benchmark('verify.mock.calls_100', ops=100)
+def verify_mock():
+    def run():
+        mock = mock_with(100)
+        for i in range(100):
+            mock.add(i)
+        assert_that(mock, verify())
+
+    return run
+
+
+@benchmark('verify.any_order.calls_100', ops=100)
+def verify_any_order():
+    order = list(range(100))
+    random.Random(1).shuffle(order)
+
+    def run():
+        mock = mock_with(100)
+        for i in order:
+            mock.add(i)
+        assert_that(mock, any_order_verify())
+
+    return run
+
+
+# properties
+
+@benchmark('property.get')
+def property_get():
+    spy = Spy(Collaborator)
+    return lambda: spy.value
+
+
+@benchmark('property.set')
+def property_set():
+    spy = Spy(Collaborator)
+
+    def set_value():
+        spy.value = 2
+
+    return set_value
+
+
+# tracer
+
+@benchmark('tracer.traced_call')
+def traced_call():
+    stub = Stub(Collaborator)
+    Tracer(lambda line: None).trace(stub)
+    return lambda: stub.hello('bob')
+
+
+@benchmark('tracer.untraced_call')
+def untraced_call():
+    stub = Stub(Collaborator)
+    return lambda: stub.hello('bob')
+
+
+# wait_that
+
+@benchmark('wait_that.already_called')
+def wait_already_called():
+    spy = Spy()
+    spy.foo()
+    return lambda: wait_that(spy.foo, called(), delta=0.001)
+
+
+@benchmark('wait_that.called_from_thread')
+def wait_called_from_thread():
+    def run():
+        spy = Spy()
+        threading.Thread(target=spy.foo).start()
+        wait_that(spy.foo, called(), delta=0.001)
+
+    return run
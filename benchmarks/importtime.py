@@ -0,0 +1,42 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+"""Time of "import doublex" as reported by "python -X importtime", the best
+of several fresh interpreters. Exits with 1 when it is over the budget:
+
+    python -m benchmarks.importtime --budget 60
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+
+def import_time(module='doublex'):
+    "cumulative import time of 'module', in seconds"
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+
+    for line in output.splitlines():
+        fields = [x.strip() for x in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(re.sub(r'\D', '', fields[1])) / 1e6
+
+    raise LookupError("'%s' not found in -X importtime output" % module)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.importtime')
+    parser.add_argument('--budget', type=float, default=60,
+                        help='milliseconds (default: 60)')
+    parser.add_argument('-n', type=int, default=5, help='interpreters to run')
+    args = parser.parse_args(argv)
+
+    best = min(import_time() for i in range(args.n))
+    print("import doublex: %.1f ms (budget %.1f ms)" % (best * 1e3, args.budget))
+    return 0 if best * 1e3 <= args.budget else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
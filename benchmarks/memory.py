@@ -0,0 +1,100 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+from doublex import (Spy, ProxySpy, Mock, FingerprintPolicy,
+                     CompactOperationList, DiskOperationList,
+                     set_recording_policy, set_recording_storage)
+
+from . import memory_benchmark
+from .cases import Collaborator
+
+
+NCALLS = 10000
+MOCK_NCALLS = 500  # each mock call is matched against the expectations
+PAYLOAD_NCALLS = 200
+PAYLOAD_SIZE = 64 * 1024
+
+
+def recording(double, ncalls=NCALLS):
+    "the double is returned so its recorded invocations are not freed"
+    def record():
+        for i in range(ncalls):
+            double.add(i)
+
+        return double
+
+    return record
+
+
+@memory_benchmark('memory.record.spy', ops=NCALLS)
+def record_spy():
+    return recording(Spy(Collaborator))
+
+
+@memory_benchmark('memory.record.free_spy', ops=NCALLS)
+def record_free_spy():
+    return recording(Spy())
+
+
+@memory_benchmark('memory.record.disk_spy', ops=NCALLS)
+def record_disk_spy():
+    spy = Spy(Collaborator)
+    set_recording_storage(spy, DiskOperationList())
+    return recording(spy)
+
+
+@memory_benchmark('memory.record.proxyspy', ops=NCALLS)
+def record_proxyspy():
+    return recording(ProxySpy(Collaborator()))
+
+
+@memory_benchmark('memory.record.mock', ops=MOCK_NCALLS)
+def record_mock():
+    with Mock(Collaborator) as mock:
+        for i in range(MOCK_NCALLS):
+            mock.add(i)
+
+    return recording(mock, MOCK_NCALLS)
+
+
+def sending_payloads(spy):
+    def send():
+        for i in range(PAYLOAD_NCALLS):
+            spy.send(bytes(PAYLOAD_SIZE))
+
+        return spy
+
+    return send
+
+
+@memory_benchmark('memory.record.payloads', ops=PAYLOAD_NCALLS)
+def record_payloads():
+    return sending_payloads(Spy())
+
+
+@memory_benchmark('memory.record.fingerprinted_payloads', ops=PAYLOAD_NCALLS)
+def record_fingerprinted_payloads():
+    spy = Spy()
+    set_recording_policy(spy, FingerprintPolicy(threshold=1024))
+    return sending_payloads(spy)
+
+
+def repeating(spy):
+    def record():
+        for i in range(NCALLS):
+            spy.incr("requests")
+
+        return spy
+
+    return record
+
+
+@memory_benchmark('memory.record.repeated', ops=NCALLS)
+def record_repeated():
+    return repeating(Spy())
+
+
+@memory_benchmark('memory.record.compact_repeated', ops=NCALLS)
+def record_compact_repeated():
+    spy = Spy()
+    set_recording_storage(spy, CompactOperationList())
+    return repeating(spy)
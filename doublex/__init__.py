@@ -1,19 +1,118 @@
 # -*- coding:utf-8; tab-width:4; mode:python -*-
 
+import importlib
+
 from .doubles import *
-from .matchers import *
-from .tracer import Tracer
-from .internal import WrongApiUsage
+from .internal import (WrongApiUsage, Method as _Method,
+                       OperationList as _OperationList, CompactOperationList,
+                       Fingerprint, FingerprintPolicy, RecordingPolicy,
+                       SnapshotPolicy, COMPARATORS as _COMPARATORS,
+                       memory_usage as _memory_usage)
 
 try:
     from ._version import *
 except ImportError:
     pass
 
+
+# loaded on first use, so "import doublex" does not import hamcrest
+_LAZY_MODULES = dict(
+    matchers=['called', 'never', 'verify', 'any_order_verify', 'timeline',
+              'in_order', 'property_got', 'property_set', 'assert_that',
+              'wait_that', 'is_', 'instance_of'],
+    tracer=['Tracer', 'BufferedTracer', 'FlightRecorder', 'JSONLinesTracer',
+            'OneInN', 'FirstThenEvery', 'RateLimit', 'Reservoir'],
+    profiler=[],
+    counters=[],
+    segments=['DiskOperationList'])
+
+_LAZY_NAMES = dict((name, module) for module, names in _LAZY_MODULES.items()
+                   for name in names)
+
+
+def __getattr__(name):
+    if name in _LAZY_MODULES:
+        return importlib.import_module('.' + name, __name__)
+
+    try:
+        module = importlib.import_module('.' + _LAZY_NAMES[name], __name__)
+    except KeyError:
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
 def set_default_behavior(double, func):
     double._default_behavior = func
 
 
+def set_fail_fast(mock, enabled=True):
+    "make the mock raise AssertionError on the first call out of the expected order"
+    if not isinstance(mock, Mock):
+        raise WrongApiUsage("set_fail_fast() takes a mock, '%s' given" % mock)
+
+    mock._fail_fast = enabled
+
+
+def dispatch_cache_info(double):
+    "hits, misses and size of the stub dispatch cache of the given double"
+    return double._dispatch_cache.info()
+
+
+def memory_usage(double):
+    """invocations and stubs held by double, and approximate bytes retained by
+    them (invocation objects, arguments, return values) and its class clone"""
+    recorded = double._recorded if isinstance(double, Spy) else _OperationList()
+    return _memory_usage(double, recorded)
+
+
+def set_recording_policy(target, policy):
+    """invocations recorded by a spy (or one of its methods) are transformed
+    by 'policy' (eg. FingerprintPolicy) once performed. None removes it"""
+    if isinstance(target, _Method) and isinstance(target.double, Spy):
+        spy, name = target.double, target.name
+    elif isinstance(target, Spy):
+        spy, name = target, None
+    else:
+        raise WrongApiUsage(
+            "set_recording_policy() takes a spy or spy method, '%s' given" % target)
+
+    if policy is None:
+        spy._recording_policies.pop(name, None)
+    else:
+        spy._recording_policies[name] = policy
+
+
+def set_recording_storage(spy, storage):
+    """record the invocations of spy in 'storage' (eg. CompactOperationList()),
+    which receives the ones recorded so far"""
+    if not isinstance(spy, Spy):
+        raise WrongApiUsage("set_recording_storage() takes a spy, '%s' given" % spy)
+
+    storage.extend(spy._recorded)
+    spy._recorded = storage
+
+
+def register_comparator(cls, compare):
+    """compare(a, b) -> bool is used instead of '==' to match arguments that
+    are instances of cls (or its subclasses)"""
+    _COMPARATORS.register(cls, compare)
+
+
+def unregister_comparator(cls):
+    _COMPARATORS.unregister(cls)
+
+
+def set_introspection_cache(directory):
+    """keep collaborator class introspection results in 'directory', shared
+    by test processes (None disables it)"""
+    from .introspection import CACHE
+    CACHE.save()
+    CACHE.set_directory(directory)
+    CACHE.clear()
+
+
 def when(double):
     if not isinstance(double, Stub):
         raise WrongApiUsage("when() takes a double, '%s' given" % double)
@@ -29,3 +128,29 @@ def expect_call(mock):
         raise WrongApiUsage("expect_call() takes a mock, '%s' given" % mock)
 
     return mock._activate_next()
+
+
+def enable_stats():
+    "start counting doubles, invocations, comparisons and cache hits"
+    from .counters import REGISTRY
+    REGISTRY.enable()
+
+
+def disable_stats():
+    from .counters import REGISTRY
+    REGISTRY.disable()
+
+
+def reset_stats():
+    from .counters import REGISTRY
+    REGISTRY.reset()
+
+
+def stats():
+    "dict with the counters collected since enable_stats() (or reset_stats())"
+    from .counters import REGISTRY
+    return REGISTRY.snapshot()
+
+
+__all__ = [name for name in list(globals()) if not name.startswith('_')
+           and name != 'importlib'] + list(_LAZY_NAMES)
@@ -0,0 +1,132 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+"""Process-wide doublex counters, enabled with enable_stats() and read with
+stats(). Each thread counts on its own accumulator; they are merged on read.
+Counting hooks are installed by enable_stats() and removed by
+disable_stats(), so they cost nothing while disabled.
+"""
+
+import threading
+from collections import Counter
+
+from . import proxy
+from .doubles import Stub
+from .internal import (Method, Property, DispatchCache, Invocation,
+                       PropertyInvocation, InvocationContext)
+from .patches import PATCHES
+
+
+DOUBLE_TYPES = ('Stub', 'Spy', 'ProxySpy', 'Mock')
+
+
+class StatsRegistry(object):
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.accumulators = []
+
+    def counter(self):
+        try:
+            return self.local.counter
+        except AttributeError:
+            pass
+
+        with self.lock:
+            retval = self.local.counter = Counter()
+            self.accumulators.append(retval)
+            return retval
+
+    def enable(self):
+        if self.enabled:
+            return
+
+        self.enabled = True
+        self._patch(Stub, '_clone_class', self._count_clones)
+        self._patch(Method, '__call__', self._counting('invocations'))
+        self._patch(Property, 'manage', self._counting('invocations'))
+        self._patch(Invocation, '__eq__', self._counting('stub_comparisons'))
+        self._patch(PropertyInvocation, '__eq__', self._counting('stub_comparisons'))
+        self._patch(InvocationContext, '_assert_values_match',
+                    self._counting('matcher_evaluations'))
+        self._patch(proxy.Proxy, 'get_signature',
+                    self._counting('signature_introspections'))
+        self._patch(DispatchCache, 'lookup', self._count_cache_lookups)
+
+    def disable(self):
+        PATCHES.remove(self)
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            for counter in self.accumulators:
+                counter.clear()
+
+    def snapshot(self):
+        total = Counter()
+        with self.lock:
+            for counter in self.accumulators:
+                total.update(counter)
+
+        doubles = dict((key[1], value) for key, value in total.items()
+                       if isinstance(key, tuple))
+        retval = dict((key, total[key]) for key in (
+            'classes_cloned', 'invocations', 'stub_comparisons',
+            'matcher_evaluations', 'signature_introspections',
+            'cache_hits', 'cache_misses'))
+        retval['doubles'] = doubles
+        lookups = retval['cache_hits'] + retval['cache_misses']
+        retval['cache_hit_rate'] = retval['cache_hits'] / lookups if lookups else 0.0
+        return retval
+
+    def _patch(self, owner, name, make_wrapper):
+        PATCHES.install(self, owner, name, make_wrapper)
+
+    def _counting(self, key):
+        counter = self.counter
+
+        def make_wrapper(func):
+            def wrapper(*args, **kargs):
+                counter()[key] += 1
+                return func(*args, **kargs)
+
+            return wrapper
+        return make_wrapper
+
+    def _count_clones(self, func):
+        counter = self.counter
+
+        def wrapper(cls):
+            accumulator = counter()
+            accumulator['classes_cloned'] += 1
+            accumulator[('doubles', double_type(cls))] += 1
+            return func(cls)
+
+        return wrapper
+
+    def _count_cache_lookups(self, func):
+        counter = self.counter
+
+        def wrapper(cache, stubs, invocation):
+            hits, misses = cache.hits, cache.misses
+            retval = func(cache, stubs, invocation)
+            accumulator = counter()
+            accumulator['cache_hits'] += cache.hits - hits
+            accumulator['cache_misses'] += cache.misses - misses
+            return retval
+
+        return wrapper
+
+
+def double_type(cls):
+    for base in cls.__mro__:
+        if base.__name__.startswith('Mimic_'):
+            return 'Mimic'
+
+        if base.__name__ in DOUBLE_TYPES and base.__module__ == Stub.__module__:
+            return base.__name__
+
+    return cls.__name__
+
+
+REGISTRY = StatsRegistry()
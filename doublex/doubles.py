@@ -19,15 +19,12 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 
-import inspect
-from typing import Generic
-
-import hamcrest
-
 from .internal import (ANY_ARG, OperationList, Method, MockBase, SpyBase,
-                       AttributeFactory, WrongApiUsage)
+                       AttributeFactory, DispatchCache, WrongApiUsage,
+                       LazyModule, hamcrest)
 from .proxy import create_proxy, get_class
-from .matchers import MockIsExpectedInvocation
+
+inspect = LazyModule('inspect')
 
 
 __all__ = ['Stub', 'Spy', 'ProxySpy', 'Mock', 'Mimic',
@@ -52,6 +49,7 @@ class Stub(object):
     def __init__(self, collaborator=None):
         self._proxy = create_proxy(collaborator)
         self._stubs = OperationList()
+        self._dispatch_cache = DispatchCache()
         self._setting_up = False
         self._new_attr_hooks = self._new_attr_hooks[:]
         self._deactivate = False
@@ -74,13 +72,14 @@ class Stub(object):
 
         if self._setting_up:
             self._stubs.append(invocation)
+            self._dispatch_cache.add_stub(invocation)
             return invocation
 
         self._prepare_invocation(invocation)
 
         stubbed_retval = self._default_behavior()
-        if invocation in self._stubs:
-            stubbed = self._stubs.lookup(invocation)
+        stubbed = self._dispatch_cache.lookup(self._stubs, invocation)
+        if stubbed is not None:
             stubbed_retval = stubbed._apply_stub(invocation)
 
         actual_retval = self._perform_invocation(invocation)
@@ -121,9 +120,40 @@ class Stub(object):
 class Spy(Stub, SpyBase):
     def __init__(self, collaborator=None):
         self._recorded = OperationList()
+        self._recording_policies = {}  # method name (None for all) -> policy
         super(Spy, self).__init__(collaborator)
 
+    def _manage_invocation(self, invocation):
+        if not self._recording_policies or self._setting_up:
+            return super(Spy, self)._manage_invocation(invocation)
+
+        policy = self._recording_policy(invocation.name)
+        if policy is None:
+            return super(Spy, self)._manage_invocation(invocation)
+
+        # stubs and the collaborator get the actual arguments
+        captured = policy.capture(invocation.context)
+        try:
+            return super(Spy, self)._manage_invocation(invocation)
+        finally:
+            policy.record(invocation.context, captured)
+
+    def _recording_policy(self, name):
+        policies = self._recording_policies
+        return policies.get(name, policies.get(None))
+
+    def _recorded_context(self, name, context):
+        "context as it would be recorded by the spy"
+        policy = self._recording_policy(name)
+        if policy is None:
+            return context
+
+        retval = context.copy()
+        policy.record(retval)
+        return retval
+
     def _prepare_invocation(self, invocation):
+        invocation._stamp()
         self._recorded.append(invocation)
 
     def _received_invocation(self, invocation, times, cmp_pred=None):
@@ -131,8 +161,13 @@ class Spy(Stub, SpyBase):
             self._recorded.count(invocation, cmp_pred))
 
     def _get_invocations_to(self, name):
-        return [i for i in self._recorded
-                if self._proxy.same_method(name, i.name)]
+        "a list, or a generator if the storage is not an in-memory list"
+        invocations = (i for i in self._recorded
+                       if self._proxy.same_method(name, i.name))
+        if isinstance(self._recorded, list):
+            return list(invocations)
+
+        return invocations
 
 
 class ProxySpy(Spy):
@@ -149,10 +184,50 @@ class ProxySpy(Spy):
 
 
 class Mock(Spy, MockBase):
+    def __init__(self, collaborator=None):
+        self._in_order = 0  # leading invocations matching the expectations
+        self._cursor = 0    # expectation the next invocation should match
+        self._cursor_used = 0
+        self._fail_fast = False
+        super(Mock, self).__init__(collaborator)
+
     def _prepare_invocation(self, invocation):
-        hamcrest.assert_that(self, MockIsExpectedInvocation(invocation))
+        expected = self._next_expected()
+        if expected is not None and self._in_order == len(self._recorded) and \
+                expected == invocation:
+            self._advance_cursor(expected)
+        else:
+            from .matchers import (MockIsExpectedInvocation, MockExpectsInvocationAt,
+                                   assert_that)
+            if self._fail_fast:
+                assert_that(self, MockExpectsInvocationAt(
+                    invocation, expected, len(self._recorded)))
+            assert_that(self, MockIsExpectedInvocation(invocation))
+
         super(Mock, self)._prepare_invocation(invocation)
 
+    def _next_expected(self):
+        if self._cursor < len(self._stubs):
+            return self._stubs[self._cursor]
+
+    def _advance_cursor(self, expected):
+        self._in_order += 1
+        self._cursor_used += 1
+        if self._cursor_used >= expected._times:
+            self._cursor += 1
+            self._cursor_used = 0
+
+    def _expectations_met(self):
+        if self._in_order == len(self._recorded):
+            return self._next_expected() is None
+
+        # expectations added after the invocations
+        if self._stubs.total() != len(self._recorded):
+            return False
+
+        return all(expected == actual for expected, actual in
+                   zip(self._stubs.expanded(), self._recorded))
+
 
 def Mimic(double, collab):
     def __getattribute__hook(self, key):
@@ -179,6 +254,8 @@ def Mimic(double, collab):
     assert issubclass(double, Stub), \
         "Mimic() takes a double class as first argument (got %s instead)" & double
 
+    from typing import Generic
+
     collab_class = get_class(collab)
     base_classes = tuple(base for base in collab_class.__bases__ if base is not Generic)
     generated_class = type(
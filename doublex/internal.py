@@ -19,14 +19,39 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 
+import array
 import functools
+import heapq
+import importlib
+import itertools
+import sys
 import threading
+import time
+import types
+from collections import namedtuple, OrderedDict
 from collections.abc import Callable as abc_Callable, Mapping as abc_Mapping
 from enum import Enum
 from functools import total_ordering
 
-import hamcrest
-from hamcrest.core.base_matcher import BaseMatcher
+
+class LazyModule(object):
+    "the module is imported on first attribute access"
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, key):
+        value = getattr(importlib.import_module(self._name), key)
+        setattr(self, key, value)
+        return value
+
+
+hamcrest = LazyModule('hamcrest')
+
+
+def is_matcher(value):
+    # there are no matchers while hamcrest is not imported
+    module = sys.modules.get('hamcrest.core.matcher')
+    return module is not None and isinstance(value, module.Matcher)
 
 
 class WrongApiUsage(Exception):
@@ -50,42 +75,638 @@ ANY_ARG = Constant.ANY_ARG
 UNSPECIFIED = Constant.UNSPECIFIED
 
 
+# process-wide invocation order. next() on itertools.count is atomic in CPython
+SEQUENCE = itertools.count()
+
+
 def add_indent(text, indent=0):
     return "%s%s" % (' ' * indent, text)
 
 
 class OperationList(list):
     def lookup(self, invocation):
-        if not invocation in self:
+        retval = self.find(invocation)
+        if retval is None:
             raise LookupError
 
-        return [i for i in self if invocation == i][-1]
+        return retval
+
+    def find(self, invocation):
+        "last operation matching the invocation (or None)"
+        for i in reversed(self):
+            if invocation == i:
+                return i
+
+        return None
 
     def show(self, indent=0):
         if not self:
             return add_indent("No one", indent)
 
-        lines = [add_indent(i, indent) for i in self]
+        lines = [add_indent(i._show_times(), indent) for i in self]
         return str.join('\n', lines)
 
+    def expanded(self):
+        "each operation repeated as many times as expected"
+        for i in self:
+            for n in range(i._times):
+                yield i
+
+    def total(self):
+        return sum(i._times for i in self)
+
     def count(self, invocation, predicate=None):
         if predicate is None:
             return list.count(self, invocation)
 
         return [predicate(invocation, i) for i in self].count(True)
 
+    def stored(self):
+        "operations actually kept in memory"
+        return self
+
+
+class Run(object):
+    "equal invocations recorded by a CompactOperationList"
+    __slots__ = ('invocation', 'count', 'ranges')
+
+    def __init__(self, invocation):
+        self.invocation = invocation
+        self.count = 1
+        # flat [start, stop) sequence pairs
+        self.ranges = array.array('q', (invocation.sequence, invocation.sequence + 1))
+
+    def add(self, sequence):
+        self.count += 1
+        if self.ranges[-1] == sequence:
+            self.ranges[-1] = sequence + 1
+        else:
+            self.ranges.extend((sequence, sequence + 1))
+
+    def expanded(self):
+        "one invocation per recorded call, in sequence order"
+        if self.count == 1:
+            yield self.invocation
+            return
+
+        first = self.invocation
+        for n in range(0, len(self.ranges), 2):
+            for sequence in range(self.ranges[n], self.ranges[n + 1]):
+                if sequence == first.sequence:
+                    yield first
+                    continue
+
+                retval = object.__new__(type(first))
+                retval.__dict__.update(first.__dict__)
+                retval.sequence = sequence
+                yield retval
+
+
+class CompactOperationList(object):
+    """Spy storage for repetitive traffic: invocations with the same name,
+    immutable arguments and return value are stored once, with a count and
+    the sequence numbers of the calls. Iteration yields one invocation per
+    call (repeated calls share the context and timestamp of the first one).
+    Invocations with other arguments are kept as given."""
+    def __init__(self):
+        self.runs = []
+        self.by_key = {}
+        self.pending = None  # last invocation: its retval is not known yet
+        self.length = 0
+
+    def append(self, invocation):
+        pending, self.pending = self.pending, invocation
+        self.length += 1
+        if pending is not None:
+            self._fold(pending)
+
+    def extend(self, invocations):
+        for i in invocations:
+            self.append(i)
+
+    def _fold(self, invocation):
+        try:
+            retval = invocation.context.retval
+            try:
+                retval_key = cache_key(retval)
+            except Uncacheable:
+                retval_key = ('id', id(retval))  # kept alive by the context
+
+            key = (invocation._cache_key(), retval_key)
+        except Uncacheable:
+            self.runs.append(Run(invocation))
+            return
+
+        try:
+            self.by_key[key].add(invocation.sequence)
+        except KeyError:
+            run = self.by_key[key] = Run(invocation)
+            self.runs.append(run)
+
+    def _settle(self):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            self._fold(pending)
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __iter__(self):
+        self._settle()
+        if len(self.runs) == 1:
+            return self.runs[0].expanded()
+
+        return heapq.merge(*[run.expanded() for run in self.runs],
+                           key=lambda i: i.sequence)
+
+    def count(self, invocation, predicate=None):
+        self._settle()
+        if predicate is None:
+            return sum(run.count for run in self.runs if run.invocation == invocation)
+
+        return sum(run.count for run in self.runs
+                   if predicate(invocation, run.invocation))
+
+    def stored(self):
+        self._settle()
+        return [run.invocation for run in self.runs]
+
+    def show(self, indent=0):
+        self._settle()
+        if not self.runs:
+            return add_indent("No one", indent)
+
+        lines = []
+        for run in self.runs:
+            line = str(run.invocation)
+            if run.count > 1:
+                line += " -- times: %s" % run.count
+            lines.append(add_indent(line, indent))
+
+        return str.join('\n', lines)
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+# only values of these types take part in dispatch cache keys: they are
+# immutable, so a matcher can not give a different answer for the same value
+CACHEABLE_TYPES = frozenset([int, float, complex, bool, str, bytes, type(None)])
+
+
+class Uncacheable(Exception):
+    pass
+
+
+class Comparators(object):
+    """equality functions for argument types, used instead of '=='.
+    'generation' changes with them, so caches know their entries are stale."""
+    def __init__(self):
+        self.registered = {}
+        self.resolved = {}
+        self.generation = 0
+
+    def register(self, cls, compare):
+        self.registered[cls] = compare
+        self.resolved = {}
+        self.generation += 1
+
+    def unregister(self, cls):
+        self.registered.pop(cls, None)
+        self.resolved = {}
+        self.generation += 1
+
+    def get(self, value):
+        "comparator for the type of value (or its nearest base), or None"
+        cls = type(value)
+        try:
+            return self.resolved[cls]
+        except KeyError:
+            pass
+
+        retval = None
+        for base in cls.__mro__:
+            if base in self.registered:
+                retval = self.registered[base]
+                break
+
+        self.resolved[cls] = retval
+        return retval
+
+
+COMPARATORS = Comparators()
+
+
+def cache_key(value):
+    "type aware key for immutable values, raises Uncacheable otherwise"
+    if type(value) is tuple:
+        return (tuple, tuple([cache_key(x) for x in value]))
+
+    if type(value) not in CACHEABLE_TYPES or value != value:  # NaN
+        raise Uncacheable(value)
+
+    # the comparator may not agree with hash() and '=='
+    if COMPARATORS.registered and COMPARATORS.get(value) is not None:
+        raise Uncacheable(value)
+
+    return (type(value), value)
+
+
+def loose_key(normalized_key):
+    "argument values of an Invocation._normalized_key(), without their types"
+    def loose(key):
+        if type(key) is not tuple:
+            return key
+        if len(key) == 2 and isinstance(key[0], type) and key[0] is not tuple:
+            return key[1]  # cache_key() of a value
+        return tuple(loose(x) for x in key)
+
+    return loose(normalized_key[2:])
+
+
+def is_equality_based(value):
+    "the stub value matches any argument with the same type and value alike"
+    if value is ANY_ARG:
+        return True
+
+    if is_matcher(value):
+        from hamcrest.core.core.is_ import Is
+        from hamcrest.core.core.isanything import IsAnything
+        from hamcrest.core.core.isequal import IsEqual
+        from hamcrest.core.core.isinstanceof import IsInstanceOf
+
+        if isinstance(value, Is):
+            return is_equality_based(value.matcher)
+
+        return isinstance(value, (IsEqual, IsAnything, IsInstanceOf))
+
+    if isinstance(value, (tuple, list)):
+        return all(is_equality_based(x) for x in value)
+
+    if isinstance(value, dict):
+        return all(is_equality_based(x) for x in value.values())
+
+    return True
+
+
+class StubIndex(object):
+    """Find the last stub matching an invocation without comparing it with
+    every stub. Stubs with immutable arguments are indexed by method and
+    argument values (1 and 1.0 share an entry), the others are kept by
+    method. Candidates are still compared with the invocation. Properties
+    compare by name only, so they are not indexed.
+    """
+    def __init__(self):
+        self.literal = {}  # (method key, argument values) -> [(position, stub)]
+        self.scanned = {}  # method key -> [(position, stub)]
+        self.indexed = 0
+
+    def _key(self, invocation):
+        if type(invocation) is not Invocation:
+            return None
+
+        try:
+            key = invocation._normalized_key()
+        except (Uncacheable, TypeError):
+            return None
+
+        return (invocation.double._proxy.method_key(invocation.name), loose_key(key))
+
+    def update(self, stubs):
+        if len(stubs) < self.indexed:
+            self.__init__()
+
+        for position in range(self.indexed, len(stubs)):
+            stub = stubs[position]
+            key = self._key(stub)
+            if key is None:
+                method_key = stub.double._proxy.method_key(stub.name)
+                self.scanned.setdefault(method_key, []).append((position, stub))
+            else:
+                self.literal.setdefault(key, []).append((position, stub))
+
+        self.indexed = len(stubs)
+
+    def find(self, stubs, invocation):
+        "same as stubs.find(invocation)"
+        key = self._key(invocation)
+        if key is None:
+            return stubs.find(invocation)
+
+        self.update(stubs)
+        found = None
+        for position, stub in reversed(self.literal.get(key, [])):
+            if invocation == stub:
+                found = position, stub
+                break
+
+        for position, stub in reversed(self.scanned.get(key[0], [])):
+            if found is not None and position < found[0]:
+                break
+            if invocation == stub:
+                return stub
+
+        return found and found[1]
+
+
+class DispatchCache(object):
+    """Remember which stub (if any) matched an invocation with immutable arguments.
+
+    Invocations with any other argument (unhashable, mutable or matchers) are
+    looked up in the stub list as usual. A stub with a matcher that does not
+    compare by value (like same_instance()) disables the cache for its method
+    (or for the whole double if the method may have aliases). Entries are
+    evicted in LRU order beyond 'maxsize'.
+    """
+    ALL_METHODS = object()
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.disabled = set()
+        self.hits = self.misses = 0
+        self.index = StubIndex()
+        self.generation = COMPARATORS.generation
+
+    def add_stub(self, stub):
+        self.entries.clear()
+        context = stub.context
+        if is_equality_based(context.args) and is_equality_based(context.kargs):
+            return
+
+        if stub.double._proxy.collaborator_classname() is None:
+            self.disabled.add(stub.name)
+        else:
+            self.disabled.add(self.ALL_METHODS)
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.entries))
+
+    def lookup(self, stubs, invocation):
+        if self.generation != COMPARATORS.generation:
+            # keys depend on the registered comparators
+            self.generation = COMPARATORS.generation
+            self.entries.clear()
+            self.index = StubIndex()
+
+        if self.disabled and (invocation.name in self.disabled or
+                              self.ALL_METHODS in self.disabled):
+            return self.index.find(stubs, invocation)
+
+        try:
+            key = invocation._cache_key()
+        except Uncacheable:
+            return self.index.find(stubs, invocation)
+
+        try:
+            retval = self.entries[key]
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return retval
+        except KeyError:
+            pass
+
+        self.misses += 1
+        retval = self.index.find(stubs, invocation)
+        self.entries[key] = retval
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        return retval
+
+
+class Fingerprint(object):
+    "type, size and digest of a large argument, recorded instead of the value"
+    __slots__ = ('typename', 'size', 'digest')
+
+    def __init__(self, typename, size, digest):
+        self.typename = typename
+        self.size = size
+        self.digest = digest
+
+    @classmethod
+    def compare(cls, a, b):
+        if not isinstance(a, Fingerprint) and nbytes(a) is not None:
+            a = fingerprint(a)
+        if not isinstance(b, Fingerprint) and nbytes(b) is not None:
+            b = fingerprint(b)
+
+        return a == b
+
+    def __eq__(self, other):
+        return isinstance(other, Fingerprint) and \
+            (self.typename, self.size, self.digest) == \
+            (other.typename, other.size, other.digest)
+
+    def __hash__(self):
+        return hash((self.typename, self.size, self.digest))
+
+    def __repr__(self):
+        return "<%s size=%s blake2b=%s>" % (self.typename, self.size, self.digest[:16])
+
+    __str__ = __repr__
+
+
+def nbytes(value):
+    "size of a str or bytes-like value, None for other values"
+    if isinstance(value, str):
+        return len(value)
+
+    try:
+        return memoryview(value).nbytes
+    except TypeError:
+        return None
+
+
+def fingerprint(value):
+    "Fingerprint of a str or bytes-like value"
+    import hashlib
+
+    if isinstance(value, str):
+        data = value.encode('utf-8', 'surrogatepass')
+    else:
+        data = memoryview(value)
+        if not data.c_contiguous:
+            data = data.tobytes()
+
+    return Fingerprint(type(value).__name__, nbytes(value),
+                       hashlib.blake2b(data, digest_size=16).hexdigest())
+
+
+class RecordingPolicy(object):
+    """Transform the contexts recorded by a spy. capture() is called before
+    the invocation is performed and record() after it, with the captured
+    value. Verification calls record() on the expected contexts, with None."""
+    def capture(self, context):
+        return None
+
+    def record(self, context, captured=None):
+        pass
+
+
+class FingerprintPolicy(RecordingPolicy):
+    """Spy recording policy: str and bytes-like arguments bigger than
+    'threshold' bytes are recorded as a Fingerprint, so the spy does not keep
+    them alive. Verification fingerprints the expected values too."""
+    def __init__(self, threshold=1024 * 1024):
+        self.threshold = threshold
+
+    def convert(self, value):
+        if isinstance(value, Constant):
+            return value
+
+        size = nbytes(value)
+        if size is None or size <= self.threshold:
+            return value
+
+        return fingerprint(value)
+
+    def record(self, context, captured=None):
+        "replace the large arguments of context"
+        context.args = tuple(self.convert(x) for x in context.args)
+        context.kargs = dict((key, self.convert(value))
+                             for key, value in context.kargs.items())
+
+
+# never copied by SnapshotPolicy
+IMMUTABLE_TYPES = frozenset([int, float, complex, bool, str, bytes, type(None),
+                             frozenset, range, type, Constant])
+# copied by SnapshotPolicy when all their items are immutable
+FLAT_COPY_TYPES = frozenset([list, set])
+
+
+class SnapshotPolicy(RecordingPolicy):
+    """Spy recording policy: the spy records a copy of the mutable arguments
+    taken when the call was made, so later changes do not affect verification.
+    Lists, dicts and sets are copied (recursively, sharing the immutable
+    parts), instances of 'deepcopy_types' are deep-copied and any other
+    object is recorded as is."""
+    def __init__(self, deepcopy_types=()):
+        self.deepcopy_types = tuple(deepcopy_types)
+
+    def capture(self, context):
+        memo = {}
+        return (tuple(self.snapshot(x, memo) for x in context.args),
+                dict((key, self.snapshot(value, memo))
+                     for key, value in context.kargs.items()))
+
+    def record(self, context, captured=None):
+        if captured is not None:
+            context.args, context.kargs = captured
+
+    def snapshot(self, value, memo):
+        cls = type(value)
+        if cls in IMMUTABLE_TYPES:
+            return value
+
+        try:
+            return memo[id(value)]
+        except KeyError:
+            pass
+
+        if cls is bytearray:
+            retval = bytearray(value)
+        elif cls in FLAT_COPY_TYPES and \
+                IMMUTABLE_TYPES.issuperset(map(type, value)):
+            retval = cls(value)
+        elif cls is list:
+            retval = memo[id(value)] = []
+            retval.extend(self.snapshot(x, memo) for x in value)
+        elif cls is dict:
+            retval = memo[id(value)] = {}
+            for key, item in value.items():
+                retval[key] = self.snapshot(item, memo)
+        elif cls is tuple:
+            items = tuple(self.snapshot(x, memo) for x in value)
+            shared = all(x is y for x, y in zip(items, value))
+            retval = value if shared else items
+        elif cls is set:
+            retval = set(value)
+        elif self.deepcopy_types and isinstance(value, self.deepcopy_types):
+            import copy
+            retval = copy.deepcopy(value)
+        else:
+            retval = value
+
+        memo[id(value)] = retval
+        return retval
+
+
+MemoryUsage = namedtuple(
+    'MemoryUsage',
+    'invocations stubs invocation_bytes args_bytes retval_bytes class_bytes total')
+
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType,
+                types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_sizeof(value, seen):
+    "approximate bytes retained by value (objects in 'seen' are not counted)"
+    if id(value) in seen or isinstance(value, SHARED_TYPES):
+        return 0
+
+    seen.add(id(value))
+    retval = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        retval += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen)
+                      for k, v in value.items())
+    elif isinstance(value, (tuple, list, set, frozenset)):
+        retval += sum(deep_sizeof(x, seen) for x in value)
+
+    if hasattr(value, '__dict__') and not isinstance(value, Observable):
+        retval += deep_sizeof(vars(value), seen)
+
+    return retval
+
+
+def memory_usage(double, recorded):
+    """Approximate memory held by the stubs and 'recorded' invocations of
+    double. Arguments shared by several invocations are counted once."""
+    seen = set([id(double)])
+    invocations = list(double._stubs) + list(recorded.stored())
+    invocation_bytes = args_bytes = retval_bytes = 0
+
+    for i in invocations:
+        if id(i) in seen:
+            continue
+
+        seen.add(id(i))
+        context = i.context
+        invocation_bytes += sum(sys.getsizeof(x) for x in (i, vars(i), context, vars(context)))
+        args_bytes += deep_sizeof(context.args, seen) + deep_sizeof(context.kargs, seen)
+        retval_bytes += deep_sizeof(context.retval, seen)
+
+    klass = type(double)
+    class_bytes = sys.getsizeof(klass) + sys.getsizeof(dict(klass.__dict__))
+    total = invocation_bytes + args_bytes + retval_bytes + class_bytes
+
+    return MemoryUsage(len(recorded), len(double._stubs), invocation_bytes,
+                       args_bytes, retval_bytes, class_bytes, total)
+
 
 class Observable(object):
     def __init__(self):
         self.observers = []
+        self.result_observers = []
 
     def attach(self, observer):
         self.observers.append(observer)
 
+    def attach_result_observer(self, observer):
+        "observer(args, kargs, retval) is invoked after each call"
+        self.result_observers.append(observer)
+
     def notify(self, *args, **kargs):
         for ob in self.observers:
             ob(*args, **kargs)
 
+    def notify_result(self, args, kargs, retval):
+        for ob in self.result_observers:
+            ob(args, kargs, retval)
+
     def _apply_deactivation(self, double):
         if double._deactivate:
             double._setting_up = self.double._deactivate = False
@@ -105,8 +726,11 @@ class Method(Observable):
         retval = self.double._manage_invocation(invocation)
 
         if not self.double._setting_up:
-            self._event.set()
+            if not self._event.is_set():
+                self._event.set()
             self.notify(*args, **kargs)
+            if self.result_observers:
+                self.notify_result(args, kargs, retval)
 
         self._apply_deactivation(self.double)
         return retval
@@ -118,7 +742,11 @@ class Method(Observable):
     def calls(self):
         if not isinstance(self.double, SpyBase):
             raise WrongApiUsage("Only Spy derivates store invocations")
-        return [x.context for x in self.double._get_invocations_to(self.name)]
+        invocations = self.double._get_invocations_to(self.name)
+        if isinstance(invocations, list):
+            return [x.context for x in invocations]
+
+        return (x.context for x in invocations)
 
     def _was_called(self, context, times):
         invocation = Invocation(self.double, self.name, context)
@@ -135,15 +763,12 @@ class Method(Observable):
 
     def _show_history(self):
         method = "method '%s.%s'" % (self.double._classname(), self.name)
-        invocations = self.double._get_invocations_to(self.name)
-        if not invocations:
+        lines = [add_indent("%s\n" % i, 10)
+                 for i in self.double._get_invocations_to(self.name)]
+        if not lines:
             return method + " never invoked"
 
-        retval = method + " was invoked this way:\n"
-        for i in invocations:
-            retval += add_indent("%s\n" % i, 10)
-
-        return retval
+        return method + " was invoked this way:\n" + str.join('', lines)
 
 
 def func_returning(value=None):
@@ -172,6 +797,10 @@ def func_raising(e):
 
 @total_ordering
 class Invocation(object):
+    _times = 1
+    sequence = None   # set when recorded by a spy
+    timestamp = None
+
     def __init__(self, double, name, context=None):
         self.double = double
         self.name = name
@@ -215,8 +844,7 @@ class Invocation(object):
         if n < 1:
             raise WrongApiUsage("times must be >= 1. Use is_not(called()) for 0 times")
 
-        for i in range(1, n):
-            self.double._manage_invocation(self)
+        self._times = n
 
     def _apply_stub(self, actual_invocation):
         return actual_invocation.context.apply_on(self.__delegate)
@@ -224,6 +852,25 @@ class Invocation(object):
     def _apply_on_collaborator(self):
         return self.double._proxy.perform_invocation(self)
 
+    def _cache_key(self):
+        kargs = tuple((key, cache_key(val))
+                      for key, val in self.context.kargs.items())
+        return (self.__class__, self.name, cache_key(self.context.args), kargs)
+
+    def _normalized_key(self):
+        "like _cache_key() but equal for positional and keyword forms of a call"
+        if self.context.check_some_args:
+            raise Uncacheable(self)
+
+        if self.context.signature.free:
+            return (self.__class__, self.name, cache_key(self.context.args),
+                    tuple(sorted((key, cache_key(val))
+                                 for key, val in self.context.kargs.items())))
+
+        call_args = self.context.signature.get_call_args(self.context)
+        return (self.__class__, self.name,
+                tuple(sorted((key, cache_key(val)) for key, val in call_args.items())))
+
     def __eq__(self, other):
         return self.double._proxy.same_method(self.name, other.name) and \
             self.context.matches(other.context)
@@ -238,6 +885,16 @@ class Invocation(object):
     def _show(self, indent=0):
         return add_indent(self, indent)
 
+    def _stamp(self):
+        self.sequence = next(SEQUENCE)
+        self.timestamp = time.time()
+
+    def _show_times(self):
+        if self._times == 1:
+            return str(self)
+
+        return "%s -- times: %s" % (self, self._times)
+
 
 ANY_ARG_MUST_BE_LAST = "ANY_ARG must be the last positional argument. "
 ANY_ARG_WITHOUT_KARGS = "Keyword arguments are not allowed if ANY_ARG is given. "
@@ -259,24 +916,14 @@ class InvocationContext(object):
         self.kargs = kargs
 
     def _check_ANY_ARG_sanity(self, args, kargs):
-        def find_ANY_ARG(args):
-            for i, v in enumerate(args):
-                if id(ANY_ARG) == id(v):
-                    return i
-
-            raise ValueError
-
-        try:
-            # if args.index(ANY_ARG) != len(args) - 1:
-            if find_ANY_ARG(args) != len(args) - 1:
+        if ANY_ARG.is_in(args):
+            if args[-1] is not ANY_ARG or ANY_ARG.is_in(args[:-1]):
                 raise WrongApiUsage(ANY_ARG_MUST_BE_LAST + ANY_ARG_DOC)
 
             if kargs:
                 raise WrongApiUsage(ANY_ARG_WITHOUT_KARGS + ANY_ARG_DOC)
-        except ValueError:
-            pass
 
-        if ANY_ARG.is_in(kargs.values()):
+        if kargs and ANY_ARG.is_in(kargs.values()):
             raise WrongApiUsage(ANY_ARG_CAN_BE_KARG + ANY_ARG_DOC)
 
     def apply_on(self, method):
@@ -290,16 +937,33 @@ class InvocationContext(object):
 
     @classmethod
     def _assert_values_match(cls, a, b):
+        if a is b:
+            return
+
         if all(isinstance(x, tuple) for x in (a, b)):
             return cls._assert_tuple_args_match(a, b)
 
         if all(isinstance(x, dict) for x in (a, b)):
             return cls._assert_kargs_match(a, b)
 
-        if isinstance(a, BaseMatcher):
+        if is_matcher(a):
             a, b = b, a
 
-        hamcrest.assert_that(a, hamcrest.is_(b))
+        if is_matcher(b) or isinstance(b, type):
+            hamcrest.assert_that(a, hamcrest.is_(b))
+            return
+
+        if type(a) is Fingerprint or type(b) is Fingerprint:
+            compare = Fingerprint.compare
+        else:
+            compare = COMPARATORS.registered and \
+                (COMPARATORS.get(a) or COMPARATORS.get(b))
+
+        if compare:
+            if not compare(a, b):
+                raise AssertionError("%r != %r" % (a, b))
+        elif not a == b:
+            raise AssertionError("%r != %r" % (a, b))
 
     @classmethod
     def _assert_tuple_args_match(cls, a, b):
@@ -323,6 +987,7 @@ class InvocationContext(object):
     def copy(self):
         retval = InvocationContext(*self.args, **self.kargs)
         retval.signature = self.signature
+        retval.check_some_args = self.check_some_args
         return retval
 
     def replace_ANY_ARG(self, actual):
@@ -353,6 +1018,9 @@ class InvocationContext(object):
         if matcher.check_some_args:
             matcher.kargs = self.add_unspecifed_args(matcher)
 
+        if matcher.signature.free and actual.signature.free:
+            return self._free_args_match(matcher, actual)
+
         matcher_call_args = matcher.signature.get_call_args(matcher)
         actual_call_args = actual.signature.get_call_args(actual)
 
@@ -362,6 +1030,23 @@ class InvocationContext(object):
         except AssertionError:
             return False
 
+    @classmethod
+    def _free_args_match(cls, matcher, actual):
+        if len(matcher.args) != len(actual.args) or \
+                len(matcher.kargs) != len(actual.kargs):
+            return False
+
+        try:
+            for a, b in zip(matcher.args, actual.args):
+                cls._assert_values_match(a, b)
+
+            for key, value in matcher.kargs.items():
+                cls._assert_values_match(value, actual.kargs[key])
+
+            return True
+        except (AssertionError, KeyError):
+            return False
+
     def add_unspecifed_args(self, context):
         arg_spec = context.signature.get_arg_spec()
 
@@ -431,7 +1116,7 @@ class PropertyGet(PropertyInvocation):
         super(PropertyGet, self).__init__(double, name)
 
     def _apply_on_collaborator(self):
-        return getattr(self.double._proxy.collaborator, self.name)
+        return self.double._proxy.get_value(self.name)
 
     def __repr__(self):
         return "get %s.%s" % (self.double._classname(), self.name)
@@ -467,10 +1152,14 @@ class Property(property, Observable):
         return self.double._manage_invocation(invocation)
 
     def get_value(self, obj):
-        if not self.double._setting_up:
+        setting_up = self.double._setting_up
+        if not setting_up:
             self.notify()
 
         property_get = self.manage(PropertyGet(self.double, self.key))
+        if not setting_up and self.result_observers:
+            self.notify_result((), {}, property_get)
+
         self._apply_deactivation(self.double)
         return property_get
 
@@ -485,6 +1174,8 @@ class Property(property, Observable):
             invocation.returns(value)
         else:
             self.notify(value)
+            if self.result_observers:
+                self.notify_result((value,), {}, None)
 
         self._apply_deactivation(self.double)
 
@@ -519,6 +1210,204 @@ class AttributeFactory(object):
             hook(attr)
 
 
+class AnyOrderMatching(object):
+    """Pair expected and actual invocations regardless of their order.
+
+    Invocations are bucketed by method. Inside each bucket, equal
+    expectations are grouped (with a capacity) and actual invocations are
+    assigned to groups: greedily first, then with augmenting paths for
+    the ones left. Groups of expectations with immutable arguments are
+    indexed by their normalized key; the others are few, as expectations
+    with matchers are grouped by the type and description of the matchers.
+    """
+    def __init__(self, expected, actual):
+        self.expected = expected
+        self.actual = actual
+
+    def matches(self):
+        if self.expected.total() != len(self.actual):
+            return False
+
+        expected = self._bucket_by_method(self.expected)
+        actual = self._bucket_by_method(self.actual)
+        if expected.keys() != actual.keys():
+            return False
+
+        return all(self._bucket_matches(expected[name], actual[name])
+                   for name in expected)
+
+    @classmethod
+    def _bucket_by_method(cls, invocations):
+        retval = {}
+        for i in invocations:
+            retval.setdefault(i.double._proxy.method_key(i.name), []).append(i)
+        return retval
+
+    @classmethod
+    def _normalized_key(cls, invocation):
+        try:
+            return invocation._normalized_key()
+        except (Uncacheable, TypeError):
+            return None
+
+    @classmethod
+    def _structure_key(cls, invocation):
+        """equal for expectations built from equal values or from matchers of
+        the same type and description (like instance_of(int) in a loop)"""
+        def value_key(value):
+            if value is ANY_ARG:
+                return ANY_ARG
+            try:
+                return cache_key(value)
+            except Uncacheable:
+                pass
+
+            if is_matcher(value):
+                return (type(value), str(value))
+            if type(value) in (list, tuple):
+                return (type(value), tuple(value_key(x) for x in value))
+            if type(value) is dict:
+                return (dict, tuple((k, value_key(v)) for k, v in sorted(value.items())))
+            return id(value)
+
+        context = invocation.context
+        try:
+            return (invocation.__class__, context.check_some_args,
+                    tuple(value_key(x) for x in context.args),
+                    tuple((k, value_key(v)) for k, v in sorted(context.kargs.items())))
+        except TypeError:  # unsortable keys
+            return id(invocation)
+
+    @classmethod
+    def _group(cls, invocations, key):
+        groups = {}
+        for i in invocations:
+            k = key(i)
+            if k in groups:
+                groups[k][1] += i._times
+            else:
+                groups[k] = [i, i._times]
+        return list(groups.values())
+
+    @classmethod
+    def _bucket_matches(cls, expected, actual):
+        if sum(i._times for i in expected) != len(actual):
+            return False
+
+        keyed = {}
+        residual = []
+        for i in expected:
+            key = cls._normalized_key(i)
+            if key is None:
+                residual.append(i)
+            elif key in keyed:
+                keyed[key][1] += i._times
+            else:
+                keyed[key] = [i, i._times]
+
+        # expectations with matchers are checked one by one, literal ones
+        # are found by the arguments of the actual invocation, ignoring their
+        # types (1 == 1.0) and the method name (aliases)
+        groups = cls._group(residual, cls._structure_key)
+        scanned = len(groups)
+        literal = {}
+        for key, group in keyed.items():
+            literal.setdefault(loose_key(key), []).append(len(groups))
+            groups.append(group)
+
+        def candidates(invocation, key):
+            retval = [g for g in range(scanned) if groups[g][0] == invocation]
+            if key is None:
+                # literal arguments never equal a list, dict or set
+                context = invocation.context
+                values = itertools.chain(context.args, context.kargs.values())
+                if any(type(x) in (list, dict, set) for x in values):
+                    same_args = []
+                else:
+                    same_args = range(scanned, len(groups))
+            else:
+                same_args = literal.get(loose_key(key), [])
+
+            return [g for g in same_args if groups[g][0] == invocation] + retval
+
+        return cls._assign(groups, actual, candidates)
+
+    @classmethod
+    def _assign(cls, groups, actual, candidates):
+        """True if every actual invocation gets a group, without exceeding
+        capacities. candidates(invocation, key) are the groups it fits in."""
+        members = [set() for g in groups]
+        group_of = [None] * len(actual)
+        fits = [None] * len(actual)
+        memo = {}
+
+        def fits_in(a):
+            if fits[a] is None:
+                key = cls._normalized_key(actual[a])
+                if key is None:
+                    fits[a] = candidates(actual[a], key)
+                else:
+                    if key not in memo:
+                        memo[key] = candidates(actual[a], key)
+                    fits[a] = memo[key]
+            return fits[a]
+
+        def has_room(g):
+            return len(members[g]) < groups[g][1]
+
+        def move(a, g, parent):
+            while True:
+                old = group_of[a]
+                if old is not None:
+                    members[old].discard(a)
+                members[g].add(a)
+                group_of[a] = g
+                if old is None:
+                    return
+                a, g = parent[old], old
+
+        def augment(start):
+            visited = set()
+            parent = {}
+            stack = [(start, iter(fits_in(start)))]
+            while stack:
+                node, following = stack[-1]
+                for nxt in following:
+                    if isinstance(node, tuple):  # a group: try its members
+                        stack.append((nxt, iter(fits_in(nxt))))
+                        break
+
+                    if nxt in visited:
+                        continue
+
+                    visited.add(nxt)
+                    parent[nxt] = node
+                    if has_room(nxt):
+                        move(node, nxt, parent)
+                        return True
+
+                    # members are only moved when a path is found
+                    stack.append(((nxt,), iter(members[nxt])))
+                    break
+                else:
+                    stack.pop()
+
+            return False
+
+        # the most constrained invocations first: fewer augmenting paths
+        unassigned = []
+        for a in sorted(range(len(actual)), key=lambda a: len(fits_in(a))):
+            for g in fits_in(a):
+                if has_room(g):
+                    members[g].add(a)
+                    group_of[a] = g
+                    break
+            else:
+                unassigned.append(a)
+
+        return all(augment(a) for a in unassigned)
+
+
 class SpyBase(object):
     pass
 
@@ -0,0 +1,167 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+"""Optional cache of per-class introspection results (attribute type names,
+signature kinds and argument names), shared by all the doubles of the same
+class and persisted in a directory, one JSON file per class, so that other
+processes skip introspection. Enable it with set_introspection_cache() or
+the DOUBLEX_INTROSPECTION_CACHE environment variable.
+
+A file is ignored when the source of the module of the class (or of any of
+its bases) was modified or the Python version is different. The cache is
+disabled if the directory given in the environment can not be created. Classes modified at runtime (eg. monkeypatched
+methods) should not be doubled with the cache enabled.
+"""
+
+import atexit
+import os
+import sys
+import weakref
+from collections import namedtuple
+
+
+ArgSpec = namedtuple('ArgSpec', 'args varargs varkw kwonlyargs')
+
+
+class ClassInfo(object):
+    def __init__(self, data=None):
+        data = data or {}
+        self.typenames = data.get('typenames', {})
+        self.kinds = data.get('kinds', {})
+        self.argspecs = dict((key, ArgSpec(*value)) for key, value in
+                             data.get('argspecs', {}).items())
+        self.changed = False
+
+    def get(self, table, key, compute):
+        try:
+            return getattr(self, table)[key]
+        except KeyError:
+            pass
+
+        retval = getattr(self, table)[key] = compute()
+        self.changed = True
+        return retval
+
+    def to_dict(self):
+        return dict(typenames=self.typenames, kinds=self.kinds,
+                    argspecs=dict((key, list(value)) for key, value in
+                                  self.argspecs.items()))
+
+
+def module_path(cls):
+    module = sys.modules.get(cls.__module__)
+    path = getattr(module, '__file__', None)
+    if path is None or '<locals>' in cls.__qualname__:
+        return None
+
+    return path
+
+
+class IntrospectionCache(object):
+    def __init__(self, directory=None):
+        self.classes = weakref.WeakKeyDictionary()
+        self.directory = None
+        self.registered = False
+        if directory:
+            try:
+                self.set_directory(directory)
+            except OSError:
+                self.directory = None
+
+    def set_directory(self, directory):
+        "persist class information in 'directory' (None to disable)"
+        self.directory = directory
+        if directory is None:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        if not self.registered:
+            self.registered = True
+            atexit.register(self.save)
+
+    def info(self, cls):
+        "ClassInfo for cls, or None if the cache is not enabled"
+        if self.directory is None:
+            return None
+
+        try:
+            return self.classes[cls]
+        except KeyError:
+            pass
+
+        retval = self.classes[cls] = self.load(cls) or ClassInfo()
+        return retval
+
+    def clear(self):
+        self.classes = weakref.WeakKeyDictionary()
+
+    def fname(self, cls):
+        return os.path.join(self.directory, "%s.%s.json" % (
+            cls.__module__, cls.__qualname__))
+
+    def stamp(self, cls):
+        "source path and mtime of the modules defining cls and its bases"
+        modules = []
+        for base in cls.__mro__:
+            if base.__module__ in sys.builtin_module_names:
+                continue  # only changes with the Python version
+
+            path = module_path(base)
+            if path is None:
+                return None
+
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                return None
+
+            if [path, mtime] not in modules:
+                modules.append([path, mtime])
+
+        return dict(modules=modules, python=sys.version)
+
+    def load(self, cls):
+        stamp = self.stamp(cls)
+        if stamp is None:
+            return None
+
+        import json
+        try:
+            with open(self.fname(cls)) as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('stamp') != stamp:
+            return None
+
+        try:
+            return ClassInfo(data)
+        except (TypeError, AttributeError):
+            return None
+
+    def save(self):
+        "write the class information changed since it was loaded"
+        if self.directory is None:
+            return
+
+        import json
+        for cls, info in list(self.classes.items()):
+            stamp = self.stamp(cls)
+            if not info.changed or stamp is None:
+                continue
+
+            data = info.to_dict()
+            data['stamp'] = stamp
+            fname = self.fname(cls)
+            tmp = "%s.%s.tmp" % (fname, os.getpid())
+            try:
+                with open(tmp, 'w') as fd:
+                    json.dump(data, fd)
+                os.replace(tmp, fname)
+                info.changed = False
+            except (OSError, TypeError, ValueError):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+
+CACHE = IntrospectionCache(os.environ.get('DOUBLEX_INTROSPECTION_CACHE'))
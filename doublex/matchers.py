@@ -20,6 +20,8 @@
 
 import sys
 import time
+import heapq
+import weakref
 import hamcrest
 from hamcrest.core.matcher import Matcher
 from hamcrest.core.base_matcher import BaseMatcher
@@ -27,11 +29,13 @@ from hamcrest import is_, instance_of
 
 from .internal import (
     Method, InvocationContext, ANY_ARG, MockBase, SpyBase,
-    PropertyGet, PropertySet, WrongApiUsage, Invocation)
+    PropertyGet, PropertySet, WrongApiUsage, Invocation, AnyOrderMatching,
+    OperationList)
 
 __all__ = ['called',
            'never',
            'verify', 'any_order_verify',
+           'timeline', 'in_order',
            'property_got', 'property_set',
            'assert_that', 'wait_that',
            'is_', 'instance_of']
@@ -47,12 +51,29 @@ class MatcherRequiredError(Exception):
     pass
 
 
-def assert_that(actual, matcher=None, reason=''):
+# objects with an assertion_failed(exception) method, like FlightRecorder
+failure_listeners = weakref.WeakSet()
+
+
+def _assert_that(actual, matcher=None, reason=''):
     if matcher and not isinstance(matcher, Matcher):
         raise MatcherRequiredError("%s should be a hamcrest Matcher" % str(matcher))
     return hamcrest.assert_that(actual, matcher, reason)
 
 
+def notify_failure(exception):
+    for listener in list(failure_listeners):
+        listener.assertion_failed(exception)
+
+
+def assert_that(actual, matcher=None, reason=''):
+    try:
+        return _assert_that(actual, matcher, reason)
+    except AssertionError as e:
+        notify_failure(e)
+        raise
+
+
 def wait_that(actual, matcher, reason='', delta=1, timeout=5):
     '''
     Poll the given matcher each 'delta' seconds until 'matcher'
@@ -67,7 +88,7 @@ def wait_that(actual, matcher, reason='', delta=1, timeout=5):
                 timeout_reached = True
                 break
 
-            assert_that(actual, matcher, reason)
+            _assert_that(actual, matcher, reason)
             break
 
         except AssertionError as e:
@@ -77,6 +98,7 @@ def wait_that(actual, matcher, reason='', delta=1, timeout=5):
     if timeout_reached:
         msg = exc.args[0] + ' after {0} seconds'.format(timeout)
         exc.args = msg,
+        notify_failure(exc)
         raise exc
 
 
@@ -93,15 +115,16 @@ class MethodCalled(OperationMatcher):
     def _matches(self, method):
         self._assure_is_spied_method(method)
         self.method = method
+        self.expected = method.double._recorded_context(method.name, self.context)
         if not self._async_timeout:
-            return method._was_called(self.context, self._times)
+            return method._was_called(self.expected, self._times)
 
         if self._async_timeout:
             if self._times != any_time:
                 raise WrongApiUsage("'times' and 'async_mode' are exclusive")
             self.method._event.wait(self._async_timeout)
 
-        return method._was_called(self.context, self._times)
+        return method._was_called(self.expected, self._times)
 
     def _assure_is_spied_method(self, method):
         if not isinstance(method, Method) or not isinstance(method.double, SpyBase):
@@ -110,7 +133,7 @@ class MethodCalled(OperationMatcher):
     def describe_to(self, description):
         description.append_text('these calls:\n')
         description.append_text(self.method._show(indent=10))
-        description.append_text(str(self.context))
+        description.append_text(str(self.expected))
         if self._times != any_time:
             description.append_text(' -- times: %s' % self._times)
 
@@ -169,7 +192,7 @@ class MockIsExpectedInvocation(BaseMatcher):
 
     def _matches(self, mock):
         self.mock = mock
-        return self.invocation in mock._stubs
+        return mock._dispatch_cache.index.find(mock._stubs, self.invocation) is not None
 
     def describe_to(self, description):
         description.append_text("these calls:\n")
@@ -180,6 +203,34 @@ class MockIsExpectedInvocation(BaseMatcher):
         description.append_text(self.invocation._show(indent=10))
 
 
+class MockExpectsInvocationAt(BaseMatcher):
+    'assert the invocation is the next mock expectation'
+    def __init__(self, invocation, expected, index):
+        self.invocation = invocation
+        self.expected = expected
+        self.index = index
+
+    def _matches(self, mock):
+        self.mock = mock
+        return self.expected is not None and self.expected == self.invocation
+
+    def describe_to(self, description):
+        if self.expected is None:
+            description.append_text("no more calls after %s expected ones" %
+                                    self.mock._stubs.total())
+            return
+
+        description.append_text("call #%s to be:\n" % (self.index + 1))
+        description.append_text(self.expected._show(indent=10))
+
+    def describe_mismatch(self, actual, description):
+        description.append_text("this call was received instead:\n")
+        description.append_text(self.invocation._show(indent=10))
+        if self.index:
+            description.append_text("\nafter these ones:\n")
+            description.append_text(self.mock._recorded.show(indent=10))
+
+
 class verify(BaseMatcher):
     def _matches(self, mock):
         if not isinstance(mock, MockBase):
@@ -189,7 +240,7 @@ class verify(BaseMatcher):
         return self._expectations_match()
 
     def _expectations_match(self):
-        return self.mock._stubs == self.mock._recorded
+        return self.mock._expectations_met()
 
     def describe_to(self, description):
         description.append_text("these calls:\n")
@@ -202,7 +253,67 @@ class verify(BaseMatcher):
 
 class any_order_verify(verify):
     def _expectations_match(self):
-        return sorted(self.mock._stubs) == sorted(self.mock._recorded)
+        return AnyOrderMatching(self.mock._stubs, self.mock._recorded).matches()
+
+
+class Timeline(object):
+    "invocations of several spies, merged again on each iteration"
+    def __init__(self, doubles):
+        self.doubles = doubles
+
+    def __iter__(self):
+        return heapq.merge(*[double._recorded for double in self.doubles],
+                           key=lambda i: i.sequence)
+
+
+def timeline(*doubles):
+    """invocations recorded by the given spies, in the order they happened.
+    A list, or a lazy iterable if some spy storage is not an in-memory list"""
+    for double in doubles:
+        if not isinstance(double, SpyBase):
+            raise WrongApiUsage("timeline() takes spies (got %s instead)" % double)
+
+    retval = Timeline(doubles)
+    if all(isinstance(double._recorded, list) for double in doubles):
+        return OperationList(retval)
+
+    return retval
+
+
+class in_order(BaseMatcher):
+    """Checks a timeline contains calls to the given spy methods in that order
+    (other calls may happen in between)::
+
+        assert_that(timeline(db, cache), in_order(db.query, cache.set))
+    """
+    def __init__(self, *methods):
+        for method in methods:
+            if not isinstance(method, Method) or not isinstance(method.double, SpyBase):
+                raise WrongApiUsage("in_order() takes spy methods (got %s instead)" % method)
+
+        self.methods = methods
+
+    def _matches(self, invocations):
+        self.invocations = invocations
+        pending = iter(self.methods)
+        method = next(pending, None)
+        for invocation in invocations:
+            if method is None:
+                break
+
+            if invocation.double is method.double and \
+                    method.double._proxy.same_method(method.name, invocation.name):
+                method = next(pending, None)
+
+        return method is None
+
+    def describe_to(self, description):
+        description.append_text("calls in this order:\n")
+        description.append_text(str.join('\n', [m._show(indent=10) for m in self.methods]))
+
+    def describe_mismatch(self, actual, description):
+        description.append_text('calls that actually ocurred were:\n')
+        description.append_text(OperationList(self.invocations).show(indent=10))
 
 
 class property_got(OperationMatcher):
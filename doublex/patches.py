@@ -0,0 +1,52 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+"""Wrappers installed on doublex internals by the profiler and the stats.
+
+Both may wrap the same method, enabled and disabled in any order, so each
+one removes only its own wrappers: the method is rebuilt from the original
+with the wrappers left.
+"""
+
+import functools
+import threading
+
+
+class PatchRegistry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.patches = {}  # (owner, name) -> (original, [(client, make_wrapper)])
+
+    def install(self, client, owner, name, make_wrapper):
+        "wrap owner.name with make_wrapper(function), on behalf of 'client'"
+        with self.lock:
+            key = (owner, name)
+            if key not in self.patches:
+                self.patches[key] = (owner.__dict__[name], [])
+
+            self.patches[key][1].append((client, make_wrapper))
+            self._rebuild(owner, name)
+
+    def remove(self, client):
+        "remove the wrappers installed by 'client'"
+        with self.lock:
+            for owner, name in list(self.patches):
+                original, wrappers = self.patches[(owner, name)]
+                wrappers[:] = [w for w in wrappers if w[0] is not client]
+                self._rebuild(owner, name)
+
+    def _rebuild(self, owner, name):
+        original, wrappers = self.patches[(owner, name)]
+        if not wrappers:
+            setattr(owner, name, original)
+            del self.patches[(owner, name)]
+            return
+
+        is_classmethod = isinstance(original, classmethod)
+        func = original.__func__ if is_classmethod else original
+        for client, make_wrapper in wrappers:
+            func = functools.wraps(func)(make_wrapper(func))
+
+        setattr(owner, name, classmethod(func) if is_classmethod else func)
+
+
+PATCHES = PatchRegistry()
@@ -0,0 +1,185 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+"""Measure the time spent inside doublex while the SUT calls the doubles.
+
+    from doublex import profiler
+
+    profiler.enable(at_exit=True)
+    ...
+    print(profiler.summary())
+
+Instrumentation is installed by enable() and removed by disable(), so
+it costs nothing while disabled. Times are inclusive and attributed to
+the double method (or property) being called:
+
+- dispatch: the whole double call.
+- signature: checking the call against the collaborator signature.
+- matching: looking for the stub that answers the call.
+- recording: storing the call in the spy (or mock).
+- collaborator: running the real collaborator (ProxySpy). It is not
+  doublex overhead, so overhead = dispatch - collaborator.
+"""
+
+import atexit
+import sys
+import threading
+from collections import namedtuple
+from time import perf_counter
+
+from .doubles import Spy
+from .internal import (Method, Property, DispatchCache, Invocation,
+                       PropertyGet, PropertySet)
+from .patches import PATCHES
+from .proxy import Proxy, CollaboratorProxy
+
+
+SECTIONS = ('dispatch', 'signature', 'matching', 'recording', 'collaborator')
+
+ProfileEntry = namedtuple(
+    'ProfileEntry',
+    'double method calls overhead ' + str.join(' ', SECTIONS))
+
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.at_exit = False
+
+    def enable(self, at_exit=False):
+        if at_exit and not self.at_exit:
+            self.at_exit = True
+            atexit.register(self._print_summary)
+
+        if self.enabled:
+            return
+
+        self.enabled = True
+        self._patch(Method, '__call__', self._dispatch_wrapper(
+            lambda method: (method.double, method.name)))
+        self._patch(Property, 'manage', self._dispatch_wrapper(
+            lambda prop: (prop.double, prop.key)))
+
+        for owner in (Proxy, CollaboratorProxy):
+            self._patch(owner, 'assure_signature_matches',
+                        self._section_wrapper('signature'))
+
+        self._patch(DispatchCache, 'lookup', self._section_wrapper('matching'))
+        self._patch(Spy, '_prepare_invocation', self._section_wrapper('recording'))
+
+        for owner in (Invocation, PropertyGet, PropertySet):
+            self._patch(owner, '_apply_on_collaborator',
+                        self._section_wrapper('collaborator'))
+
+    def disable(self):
+        PATCHES.remove(self)
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def _patch(self, owner, name, make_wrapper):
+        PATCHES.install(self, owner, name, make_wrapper)
+
+    def _dispatch_wrapper(self, get_target):
+        local = self.local
+        add = self._add
+
+        def make_wrapper(func):
+            def wrapper(attr, *args, **kargs):
+                double, name = get_target(attr)
+                outer = getattr(local, 'key', None)
+                key = local.key = (id(double), double._classname(), name)
+                start = perf_counter()
+                try:
+                    return func(attr, *args, **kargs)
+                finally:
+                    add(key, 'dispatch', perf_counter() - start)
+                    local.key = outer
+
+            return wrapper
+        return make_wrapper
+
+    def _section_wrapper(self, section):
+        local = self.local
+        add = self._add
+
+        def make_wrapper(func):
+            def wrapper(*args, **kargs):
+                key = getattr(local, 'key', None)
+                if key is None:
+                    return func(*args, **kargs)
+
+                start = perf_counter()
+                try:
+                    return func(*args, **kargs)
+                finally:
+                    add(key, section, perf_counter() - start)
+
+            return wrapper
+        return make_wrapper
+
+    def _add(self, key, section, elapsed):
+        with self.lock:
+            try:
+                entry = self.stats[key]
+            except KeyError:
+                entry = self.stats[key] = dict.fromkeys(SECTIONS + ('calls',), 0)
+
+            entry[section] += elapsed
+            if section == 'dispatch':
+                entry['calls'] += 1
+
+    def report(self):
+        "ProfileEntry per double method, most overhead first"
+        with self.lock:
+            stats = list(self.stats.items())
+
+        retval = []
+        for (ident, double, method), entry in stats:
+            retval.append(ProfileEntry(
+                double, method, entry['calls'],
+                entry['dispatch'] - entry['collaborator'],
+                *[entry[x] for x in SECTIONS]))
+
+        return sorted(retval, key=lambda x: x.overhead, reverse=True)
+
+    def doubles(self):
+        "(double, calls, overhead) per double instance, most overhead first"
+        with self.lock:
+            stats = list(self.stats.items())
+
+        totals = {}
+        for (ident, double, method), entry in stats:
+            name, calls, overhead = totals.get(ident, (double, 0, 0))
+            totals[ident] = (name, calls + entry['calls'],
+                             overhead + entry['dispatch'] - entry['collaborator'])
+
+        return sorted(totals.values(), key=lambda x: x[2], reverse=True)
+
+    def summary(self, top=10):
+        lines = ["doublex overhead (top %s double methods):" % top]
+        for entry in self.report()[:top]:
+            lines.append(
+                "  %s.%s: %s calls, %.6fs (signature %.6fs, matching %.6fs, recording %.6fs)" % (
+                    entry.double, entry.method, entry.calls, entry.overhead,
+                    entry.signature, entry.matching, entry.recording))
+
+        return str.join('\n', lines)
+
+    def _print_summary(self):
+        if self.stats:
+            sys.stderr.write(self.summary() + '\n')
+
+
+PROFILER = Profiler()
+
+enable = PROFILER.enable
+disable = PROFILER.disable
+reset = PROFILER.reset
+report = PROFILER.report
+doubles = PROFILER.doubles
+summary = PROFILER.summary
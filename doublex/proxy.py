@@ -17,10 +17,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
-import inspect
-from inspect import getcallargs
+import itertools
+import weakref
 
-from .internal import ANY_ARG
+from .internal import ANY_ARG, LazyModule
+from .introspection import CACHE, ArgSpec
+
+inspect = LazyModule('inspect')
 
 
 def get_func(func):
@@ -42,13 +45,16 @@ class Proxy(object):
         return None
 
     def get_signature(self, method_name):
+        return SIGNATURES[self.get_signature_kind(method_name)](self, method_name)
+
+    def get_signature_kind(self, method_name):
         if self.is_property(method_name) or self.is_namedtuple_field(method_name):
-            return PropertySignature(self, method_name)
+            return 'property'
 
         if not self.is_method_or_func(method_name):
-            return BuiltinSignature(self, method_name)
+            return 'builtin'
 
-        return MethodSignature(self, method_name)
+        return 'method'
 
     def is_property(self, attr_name):
         attr = getattr(self.collaborator_class, attr_name)
@@ -76,8 +82,11 @@ class DummyProxy(Proxy):
     def same_method(self, name1, name2):
         return name1 == name2
 
+    def method_key(self, name):
+        return name
+
     def get_signature(self, method_name):
-        return DummySignature()
+        return DUMMY_SIGNATURE
 
 
 def get_class(something):
@@ -87,11 +96,119 @@ def get_class(something):
         return something.__class__
 
 
+class MethodIds(object):
+    """Number the attributes of a class, so that aliases (like
+    '__eq__ = equals') get the same id."""
+    def __init__(self):
+        self.ids = {}
+        self.by_target = {}  # id(target) -> (reference to target, number)
+        self.numbers = itertools.count()
+
+    def get(self, cls, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            pass
+
+        try:
+            attr = getattr(cls, name)
+            target = getattr(attr, '__func__', None)
+            if target is None:
+                # fresh object on each access (partialmethod, C classmethods)
+                if attr is not getattr(cls, name):
+                    return None
+                target = attr
+        except AttributeError:
+            return None
+
+        retval = self.ids[name] = self.number(target)
+        return retval
+
+    def number(self, target):
+        known = self.by_target.get(id(target))
+        if known is not None and known[0]() is target:
+            return known[1]
+
+        # weak if possible: a function may refer to its class (super() cell)
+        try:
+            reference = weakref.ref(target)
+        except TypeError:
+            reference = lambda target=target: target
+
+        retval = next(self.numbers)
+        self.by_target[id(target)] = (reference, retval)
+        return retval
+
+
+METHOD_IDS = weakref.WeakKeyDictionary()
+
+
+MISSING = object()
+
+
+class Member(object):
+    "collaborator attribute resolved by the proxy"
+    def __init__(self, stamp, signature):
+        self.stamp = stamp
+        self.signature = signature
+        self.bound = None
+
+
 class CollaboratorProxy(Proxy):
     '''Represent the collaborator object'''
     def __init__(self, collaborator):
         self.collaborator = collaborator
         self.collaborator_class = get_class(collaborator)
+        self.class_info = CACHE.info(self.collaborator_class)
+        self.method_ids = {}
+        self.members = {}
+        self.instance_dict = {}
+        if collaborator is not self.collaborator_class:
+            self.instance_dict = getattr(collaborator, '__dict__', {})
+
+    def stamp(self, name):
+        "changes when the attribute is reassigned in the instance or its class"
+        attr = getattr(self.collaborator_class, name, MISSING)
+        return (self.instance_dict.get(name, MISSING),
+                getattr(attr, '__func__', attr))
+
+    def resolve(self, name):
+        "signature and bound method of 'name', kept while it is not reassigned"
+        stamp = self.stamp(name)
+        member = self.members.get(name)
+        if member is not None and member.stamp[0] is stamp[0] and \
+                member.stamp[1] is stamp[1]:
+            return member
+
+        signature = super(CollaboratorProxy, self).get_signature(name)
+        member = self.members[name] = Member(stamp, signature)
+        return member
+
+    def get_signature(self, method_name):
+        return self.resolve(method_name).signature
+
+    def is_class_attr(self, key):
+        "'key' is not overridden by the collaborator instance"
+        return self.collaborator is self.collaborator_class or \
+            key not in getattr(self.collaborator, '__dict__', {})
+
+    def cached(self, table, key, compute):
+        if self.class_info is None or not self.is_class_attr(key):
+            return compute()
+
+        return self.class_info.get(table, key, compute)
+
+    def get_signature_kind(self, method_name):
+        return self.cached(
+            'kinds', method_name,
+            lambda: super(CollaboratorProxy, self).get_signature_kind(method_name))
+
+    def get_arg_spec(self, method_name, method):
+        def compute():
+            spec = getfullargspec(method)
+            return ArgSpec(spec.args[1:], spec.varargs, spec.varkw, spec.kwonlyargs)
+
+        return self.cached('argspecs', method_name, compute)
 
     def isclass(self):
         return inspect.isclass(self.collaborator)
@@ -116,8 +233,9 @@ class CollaboratorProxy(Proxy):
             raise AttributeError(reason)
 
         try:
-            attr = getattr(self.collaborator_class, key)
-            return type(attr).__name__
+            return self.cached(
+                'typenames', key,
+                lambda: type(getattr(self.collaborator_class, key)).__name__)
         except AttributeError:
             if self.collaborator is self.collaborator_class:
                 raise_no_attribute()
@@ -128,16 +246,64 @@ class CollaboratorProxy(Proxy):
         except AttributeError:
             raise_no_attribute()
 
+    def method_id(self, name):
+        "canonical id of class attribute 'name' (shared by its aliases) or None"
+        try:
+            return self.method_ids[name]
+        except KeyError:
+            pass
+
+        retval = None
+        if self.is_class_attr(name):
+            try:
+                table = METHOD_IDS[self.collaborator_class]
+            except KeyError:
+                table = METHOD_IDS[self.collaborator_class] = MethodIds()
+
+            retval = table.get(self.collaborator_class, name)
+
+        self.method_ids[name] = retval
+        return retval
+
+    def method_key(self, name):
+        "equal for 'name' and its aliases"
+        retval = self.method_id(name)
+        return name if retval is None else retval
+
     def same_method(self, name1, name2):
-        return getattr(self.collaborator, name1) == \
-            getattr(self.collaborator, name2)
+        if name1 == name2:
+            return True
+
+        id1, id2 = self.method_id(name1), self.method_id(name2)
+        if id1 is None or id2 is None:
+            return getattr(self.collaborator, name1) == \
+                getattr(self.collaborator, name2)
+
+        return id1 == id2
 
     def perform_invocation(self, invocation):
-        method = getattr(self.collaborator, invocation.name)
-        return invocation.context.apply_on(method)
+        member = self.resolve(invocation.name)
+        if member.bound is None:
+            member.bound = getattr(self.collaborator, invocation.name)
+
+        return invocation.context.apply_on(member.bound)
+
+    def get_value(self, name):
+        member = self.resolve(name)
+        if member.bound is None:
+            attr = getattr(self.collaborator_class, name, None)
+            fget = getattr(attr, 'fget', None)
+            if not isinstance(attr, property) or fget is None or \
+                    self.collaborator is self.collaborator_class:
+                fget = lambda obj: getattr(obj, name)
+            member.bound = fget
+
+        return member.bound(self.collaborator)
 
 
 class Signature(object):
+    free = False
+
     def __init__(self, proxy, name):
         self.proxy = proxy
         self.name = name
@@ -159,31 +325,102 @@ class Signature(object):
 
 
 class DummySignature(Signature):
+    "free double methods: arguments are compared as given"
+    free = True
+
     def __init__(self):
         pass
 
 
+DUMMY_SIGNATURE = DummySignature()
+
+
+class TextSignature(object):
+    "builtin with __text_signature__ (positional-only and keyword-only aware)"
+    def __init__(self, signature, takes_self):
+        self.signature = signature
+        self.takes_self = takes_self
+
+        Parameter = inspect.Parameter
+        kinds = [x.kind for x in signature.parameters.values()]
+        positional = [x for x in kinds
+                      if x in (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD)]
+        self.max_args = len(positional) - takes_self
+        if Parameter.VAR_POSITIONAL in kinds:
+            self.max_args = None
+
+    def check(self, classname, name, args, kargs):
+        if self.max_args is not None and len(args) > self.max_args:
+            raise TypeError('%s.%s() takes exactly %s argument (%s given)' % (
+                classname, name, self.max_args, len(args)))
+
+        if self.takes_self:
+            args = (None,) + args
+
+        try:
+            self.signature.bind(*args, **kargs)
+        except TypeError as e:
+            raise TypeError('%s.%s() %s' % (classname, name, e))
+
+
+class DocArity(object):
+    "builtin without __text_signature__, arity taken from its docstring"
+    def __init__(self, nargs):
+        self.nargs = nargs
+
+    def check(self, classname, name, args, kargs):
+        if len(args) != self.nargs:
+            raise TypeError('%s.%s() takes exactly %s argument (%s given)' % (
+                classname, name, self.nargs, len(args)))
+
+
+def parse_builtin(method, isclass):
+    if getattr(method, '__text_signature__', None):
+        try:
+            signature = inspect.signature(method)
+        except (TypeError, ValueError):
+            return None
+
+        takes_self = isclass and \
+            type(method).__name__ in ('method_descriptor', 'wrapper_descriptor')
+        return TextSignature(signature, takes_self)
+
+    doc = method.__doc__ or ''
+    if not ')' in doc:
+        return None
+
+    rpar = doc.find(')')
+    params = doc[:rpar]
+    nkargs = params.count('=')
+    nargs = params.count(',') + 1 - nkargs
+    return DocArity(nargs)
+
+
+# parsed builtin signatures, by class and (method name, collaborator is class)
+PARSED_BUILTINS = weakref.WeakKeyDictionary()
+
+
 class BuiltinSignature(Signature):
     "builtin collaborator method signature"
-    def assure_matches(self, context):
-        if self.method.__text_signature__:
-            args = context.args
-            if self.proxy.isclass():
-                args = (None,) + args  # self
-            getcallargs(self.method, *args, **context.kargs)
-            return
-        doc = self.method.__doc__
-        if not ')' in doc:
-            return
+    def parse(self):
+        proxy = self.proxy
+        isclass = proxy.isclass()
+        if not proxy.is_class_attr(self.name):
+            return parse_builtin(self.method, isclass)
+
+        table = PARSED_BUILTINS.setdefault(proxy.collaborator_class, {})
+        key = (self.name, isclass)
+        try:
+            return table[key]
+        except KeyError:
+            retval = table[key] = parse_builtin(self.method, isclass)
+            return retval
 
-        rpar = doc.find(')')
-        params = doc[:rpar]
-        nkargs = params.count('=')
-        nargs = params.count(',') + 1 - nkargs
-        if len(context.args) != nargs:
-            raise TypeError('%s.%s() takes exactly %s argument (%s given)' % (
-                self.proxy.collaborator_classname(), self.name,
-                nargs, len(context.args)))
+    def assure_matches(self, context):
+        parsed = self.parse()
+        if parsed is not None:
+            parsed.check(self.proxy.collaborator_classname(), self.name,
+                         context.args, context.kargs)
 
 
 # Thanks to David Pärsson (https://github.com/davidparsson)
@@ -194,14 +431,8 @@ def getfullargspec(method):
 
 class MethodSignature(Signature):
     "colaborator method signature"
-    def __init__(self, proxy, name):
-        super(MethodSignature, self).__init__(proxy, name)
-        self.argspec = getfullargspec(self.method)
-
     def get_arg_spec(self):
-        retval = getfullargspec(self.method)
-        del retval.args[0]
-        return retval
+        return self.proxy.get_arg_spec(self.name, self.method)
 
     def is_classmethod(self):
         return (
@@ -214,7 +445,7 @@ class MethodSignature(Signature):
         if self.proxy.isclass() and not is_classmethod:
             args = (None,) + args  # self
 
-        retval = getcallargs(self.method, *args, **context.kargs)
+        retval = inspect.getcallargs(self.method, *args, **context.kargs)
         retval.pop('cls' if is_classmethod else 'self', None)
         return retval
 
@@ -239,3 +470,9 @@ class PropertySignature(Signature):
 
     def assure_matches(self, context):
         pass
+
+
+SIGNATURES = dict(
+    property = PropertySignature,
+    builtin  = BuiltinSignature,
+    method   = MethodSignature)
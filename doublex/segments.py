@@ -0,0 +1,245 @@
+# -*- coding:utf-8; tab-width:4; mode:python -*-
+
+"""Spy storage that spills recorded invocations to disk, for histories that
+do not fit in memory. Invocations are pickled and appended to a log made of
+segment files, read back through mmap. Only an index (segment and offset of
+each invocation) and some counters are kept in memory.
+
+Recorded arguments and return values are copies when read back, so they
+should be picklable and compare by value. Invocations that can not be
+pickled are kept in memory.
+"""
+
+import array
+import itertools
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import threading
+import weakref
+from collections import Counter
+
+from .internal import (Invocation, InvocationContext, PropertyGet, PropertySet,
+                       add_indent)
+
+
+HEADER = struct.Struct('<I')
+RESIDENT = 'resident'
+KINDS = dict(Invocation=Invocation, PropertyGet=PropertyGet, PropertySet=PropertySet)
+
+
+class SegmentLog(object):
+    "append-only log of byte records split in files of 'segment_size' bytes"
+    def __init__(self, directory=None, segment_size=64 * 1024 * 1024):
+        self.segment_size = segment_size
+        self.owned = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix='doublex-')
+        os.makedirs(self.directory, exist_ok=True)
+        self.paths = []
+        self.writer = None
+        self.size = 0
+        self.segments = array.array('i')
+        self.offsets = array.array('q')
+        self._finalizer = weakref.finalize(
+            self, SegmentLog._cleanup, self.paths, self.owned and self.directory)
+
+    def append(self, record):
+        if self.writer is None or self.size >= self.segment_size:
+            self._open_segment()
+
+        self.segments.append(len(self.paths) - 1)
+        self.offsets.append(self.size)
+        self.writer.write(HEADER.pack(len(record)))
+        self.writer.write(record)
+        self.size += HEADER.size + len(record)
+
+    def _open_segment(self):
+        if self.writer is not None:
+            self.writer.close()
+
+        path = os.path.join(self.directory, 'segment-%05d-%s.log' % (
+            len(self.paths), id(self)))
+        self.paths.append(path)
+        self.writer = open(path, 'wb')
+        self.size = 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def __iter__(self):
+        "records in order, read lazily (call flush() before)"
+        for path in list(self.paths):
+            with open(path, 'rb') as fd:
+                if os.fstat(fd.fileno()).st_size == 0:
+                    continue
+
+                with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    offset, end = 0, len(data)
+                    while offset < end:
+                        size, = HEADER.unpack_from(data, offset)
+                        offset += HEADER.size
+                        yield data[offset:offset + size]
+                        offset += size
+
+    def __getitem__(self, n):
+        with open(self.paths[self.segments[n]], 'rb') as fd:
+            fd.seek(self.offsets[n])
+            size, = HEADER.unpack(fd.read(HEADER.size))
+            return fd.read(size)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+        self._finalizer()
+
+    @staticmethod
+    def _cleanup(paths, directory):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class DiskOperationList(object):
+    """Spy storage (see set_recording_storage()) that appends the recorded
+    invocations to a SegmentLog in 'directory' (a temporary one by default,
+    removed with the storage). Iteration streams them from disk."""
+    def __init__(self, directory=None, segment_size=64 * 1024 * 1024):
+        self.log = SegmentLog(directory, segment_size)
+        self.lock = threading.Lock()
+        self.double = None
+        self.pending = None  # last invocation: its retval is not known yet
+        self.resident = {}   # position -> invocation that could not be pickled
+        self.counts = Counter()  # method key -> invocations
+
+    def append(self, invocation):
+        with self.lock:
+            if self.double is None:
+                self.double = invocation.double
+
+            pending, self.pending = self.pending, invocation
+            self.counts[self._method_key(invocation)] += 1
+            if pending is not None:
+                self._write(pending)
+
+    def extend(self, invocations):
+        for i in invocations:
+            self.append(i)
+
+    def _method_key(self, invocation):
+        return invocation.double._proxy.method_key(invocation.name)
+
+    def _write(self, invocation):
+        context = invocation.context
+        kind = type(invocation).__name__
+        try:
+            if kind not in KINDS:
+                raise TypeError(kind)
+
+            record = pickle.dumps(
+                (kind, invocation.name, context.args, context.kargs, context.retval,
+                 invocation.sequence, invocation.timestamp),
+                pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            self.resident[len(self.log)] = invocation
+            record = pickle.dumps((RESIDENT,))
+
+        self.log.append(record)
+
+    def _restore(self, position, record):
+        fields = pickle.loads(record)
+        if fields[0] == RESIDENT:
+            return self.resident[position]
+
+        kind, name, args, kargs, retval, sequence, timestamp = fields
+        if kind == 'PropertyGet':
+            invocation = PropertyGet(self.double, name)
+        elif kind == 'PropertySet':
+            invocation = PropertySet(self.double, name, args[0])
+        else:
+            invocation = Invocation(self.double, name, InvocationContext(*args, **kargs))
+
+        invocation.context.retval = retval
+        invocation.sequence = sequence
+        invocation.timestamp = timestamp
+        return invocation
+
+    def __len__(self):
+        return len(self.log) + (self.pending is not None)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        # invocations appended while iterating are not yielded
+        with self.lock:
+            self.log.flush()
+            written, pending = len(self.log), self.pending
+
+        records = itertools.islice(self.log, written)
+        for position, record in enumerate(records):
+            yield self._restore(position, record)
+
+        if pending is not None:
+            yield pending
+
+    def __getitem__(self, n):
+        with self.lock:
+            self.log.flush()
+            written, pending = len(self.log), self.pending
+
+        if n < 0:
+            n += len(self)
+
+        if n == written and pending is not None:
+            return pending
+
+        if not 0 <= n < written:
+            raise IndexError(n)
+
+        return self._restore(n, self.log[n])
+
+    def count(self, invocation, predicate=None):
+        if predicate is None:
+            if not self.counts[self._method_key(invocation)]:
+                return 0
+
+            return sum(1 for i in self if i == invocation)
+
+        return sum(1 for i in self if predicate(invocation, i))
+
+    def stored(self):
+        "invocations kept in memory"
+        retval = list(self.resident.values())
+        if self.pending is not None:
+            retval.append(self.pending)
+        return retval
+
+    def show(self, indent=0, limit=100):
+        lines = []
+        for i in self:
+            if len(lines) == limit:
+                lines.append(add_indent("... (%s more)" % (len(self) - limit), indent))
+                break
+
+            lines.append(add_indent(i._show_times(), indent))
+
+        if not lines:
+            return add_indent("No one", indent)
+
+        return str.join('\n', lines)
+
+    def close(self):
+        "remove the log files"
+        self.log.close()
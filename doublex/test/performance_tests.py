@@ -0,0 +1,164 @@
+# -*- mode:python; coding:utf-8; tab-width:4 -*-
+
+"""Per-call overhead guardrails.
+
+Times are compared with a calibration loop (a plain Python method call)
+measured in the same process, never with absolute times. Limits are
+several times the ratios measured when written; set the environment
+variable DOUBLEX_PERF_TOLERANCE to scale them (eg. 3 under coverage).
+"""
+
+import os
+import subprocess
+import sys
+import timeit
+from unittest import TestCase
+
+from hamcrest import less_than, has_item, is_not
+
+import doublex
+from doublex import Stub, Spy, Mock, assert_that, called, verify
+
+
+TOLERANCE = float(os.environ.get('DOUBLEX_PERF_TOLERANCE', 1))
+
+# overhead limits, in calibration loops
+STUB_CALL = 150
+SPY_CALL = 150
+COLLABORATOR_STUB_CALL = 1500
+VERIFY_PER_RECORDED_CALL = 200
+
+# limits for the ratio between a large and a small case (10x or 100x bigger)
+DISPATCH_WITH_STUBS_GROWTH = 4
+RECORD_WITH_HISTORY_GROWTH = 4
+VERIFY_WITH_HISTORY_GROWTH = 30
+
+
+def best(func, number, repeat=5):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+class Plain(object):
+    def __init__(self):
+        self.calls = []
+
+    def foo(self, *args, **kargs):
+        self.calls.append((args, kargs))
+
+
+class Collaborator(object):
+    def foo(self, value):
+        pass
+
+
+def calibration():
+    plain = Plain()
+    return best(lambda: plain.foo(1), 20000)
+
+
+def stub_with(nstubs):
+    with Stub() as stub:
+        for i in range(nstubs):
+            stub.foo(i).returns(i)
+
+    return stub
+
+
+def spy_with(ncalls):
+    spy = Spy()
+    for i in range(ncalls):
+        spy.foo(i % 10)
+
+    return spy
+
+
+class OverheadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.calibration = calibration()
+
+    def assert_overhead(self, func, limit, number=3000):
+        ratio = best(func, number) / self.calibration
+        assert_that(ratio, less_than(limit * TOLERANCE))
+
+    def test_stub_call(self):
+        stub = stub_with(1)
+        self.assert_overhead(lambda: stub.foo(0), STUB_CALL)
+
+    def test_spy_call(self):
+        spy = Spy()
+        self.assert_overhead(lambda: spy.foo(0), SPY_CALL)
+
+    def test_collaborator_stub_call(self):
+        stub = Stub(Collaborator)
+        self.assert_overhead(lambda: stub.foo(0), COLLABORATOR_STUB_CALL)
+
+    def test_verify_called(self):
+        spy = spy_with(1000)
+        per_call = best(lambda: assert_that(spy.foo, called().times(1000)), 5) / 1000
+        assert_that(per_call / self.calibration,
+                    less_than(VERIFY_PER_RECORDED_CALL * TOLERANCE))
+
+
+class GrowthTests(TestCase):
+    def assert_growth(self, small, large, limit, number=2000):
+        ratio = best(large, number) / best(small, number)
+        assert_that(ratio, less_than(limit * TOLERANCE))
+
+    def test_dispatch_does_not_grow_with_stubs(self):
+        few, many = stub_with(10), stub_with(1000)
+        self.assert_growth(lambda: few.foo(0), lambda: many.foo(0),
+                           DISPATCH_WITH_STUBS_GROWTH)
+
+    def test_recording_does_not_grow_with_history(self):
+        fresh, busy = Spy(), spy_with(10000)
+        self.assert_growth(lambda: fresh.bar(1), lambda: busy.bar(1),
+                           RECORD_WITH_HISTORY_GROWTH)
+
+    def test_verify_grows_linearly_with_history(self):
+        short, long = spy_with(1000), spy_with(10000)
+        self.assert_growth(
+            lambda: assert_that(short.foo, called().times(1000)),
+            lambda: assert_that(long.foo, called().times(10000)),
+            VERIFY_WITH_HISTORY_GROWTH, number=2)
+
+    def test_mock_verify_does_not_grow_with_expectations(self):
+        def mock_with(ncalls):
+            with Mock() as mock:
+                for i in range(ncalls):
+                    mock.foo()
+
+            for i in range(ncalls):
+                mock.foo()
+
+            return mock
+
+        few, many = mock_with(10), mock_with(1000)
+        self.assert_growth(lambda: assert_that(few, verify()),
+                           lambda: assert_that(many, verify()),
+                           DISPATCH_WITH_STUBS_GROWTH)
+
+
+class ImportTests(TestCase):
+    def loaded_modules(self, code):
+        code = "import sys, doublex\n%s\nprint(' '.join(sys.modules))" % code
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.dirname(os.path.abspath(doublex.__file__))))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         env=env, universal_newlines=True)
+        return output.split()
+
+    def test_basic_doubles_do_not_load_hamcrest_nor_matchers(self):
+        modules = self.loaded_modules(
+            "with doublex.Stub() as stub: stub.foo(1).returns(2)\n"
+            "stub.foo(1)\n"
+            "doublex.Spy().foo(2)")
+
+        for name in ['hamcrest', 'doublex.matchers', 'doublex.tracer', 'inspect']:
+            assert_that(modules, is_not(has_item(name)))
+
+    def test_matchers_are_loaded_on_first_use(self):
+        modules = self.loaded_modules("doublex.called")
+
+        assert_that(modules, has_item('doublex.matchers'))
+        assert_that(modules, has_item('hamcrest'))
@@ -19,8 +19,15 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 
+import gc
+import os
 import sys
+import json
+import tempfile
+import time
 import itertools
+import functools
+import datetime
 import threading
 try:
     import thread
@@ -34,23 +41,32 @@ from io import StringIO
 
 
 from hamcrest import (
-    is_, is_not, instance_of, all_of, has_length, has_entry, starts_with,
+    is_, is_not, instance_of, same_instance, all_of, has_length, has_entry, starts_with,
     anything, greater_than, less_than, any_of,
-    contains_string, string_contains_in_order)
+    contains_string, string_contains_in_order, has_key)
 
 from doublex import (
     set_default_behavior,
     ANY_ARG,
     assert_that,
     when, called, never,
-    Stub, Spy, ProxySpy, Mock, Tracer, Mimic,
+    Stub, Spy, ProxySpy, Mock, Tracer, BufferedTracer, FlightRecorder,
+    JSONLinesTracer, OneInN, FirstThenEvery, RateLimit, Reservoir, Mimic,
     property_set, property_got,
     method_returning, method_raising, expect_call, verify, any_order_verify,
-    WrongApiUsage
+    WrongApiUsage, dispatch_cache_info, set_fail_fast, timeline, in_order,
+    enable_stats, disable_stats, reset_stats, stats, memory_usage,
+    set_introspection_cache, register_comparator, unregister_comparator,
+    set_recording_policy, Fingerprint, FingerprintPolicy, SnapshotPolicy,
+    set_recording_storage, CompactOperationList, DiskOperationList
     )
 
+import doublex
+from doublex import profiler
 from doublex.matchers import MatcherRequiredError
 from doublex.internal import InvocationContext, Method
+from doublex.introspection import IntrospectionCache
+from doublex.proxy import PARSED_BUILTINS, METHOD_IDS
 
 T = TypeVar('T')
 
@@ -379,6 +395,27 @@ class FreeSpyTests(TestCase):
 
         assert_that(self.spy.foo, called().with_args(cls=2))
 
+    def test_positional_and_keyword_arguments_are_different(self):
+        self.spy.foo(1, key=2)
+
+        assert_that(self.spy.foo, called().with_args(1, key=2))
+        assert_that(self.spy.foo, is_not(called().with_args(1, 2)))
+        assert_that(self.spy.foo, is_not(called().with_args(1, other=2)))
+        assert_that(self.spy.foo, is_not(called().with_args(1)))
+
+    def test_nested_matchers_in_free_double(self):
+        self.spy.foo((1, [2]), key=3)
+
+        assert_that(self.spy.foo,
+                    called().with_args((1, anything()), key=greater_than(2)))
+
+    def test_free_methods_share_signature(self):
+        self.spy.foo(1)
+        self.spy.bar(2)
+
+        signatures = [x.context.signature for x in self.spy._recorded]
+        assert_that(signatures[0], same_instance(signatures[1]))
+
 #    def test_called_anything_and_value(self):
 #        spy = Spy(Collaborator)
 #        spy.two_args_method(10, 20)
@@ -506,6 +543,37 @@ class BuiltinSpyTests(TestCase):
         spy.__setitem__(3, 5)
         assert_that(spy.__setitem__, called().with_args(3, 5))
 
+    def test_builtin_method_of_instance(self):
+        spy = Spy([])
+        spy.append(10)
+        assert_that(spy.append, called().with_args(10))
+
+        with self.assertRaises(TypeError):
+            spy.append(10, 20)
+
+    def test_builtin_keyword_only_args(self):
+        spy = Spy(list)
+        spy.sort(key=len, reverse=True)
+        assert_that(spy.sort, called())
+
+        with self.assertRaises(TypeError):
+            spy.sort(len)
+
+    def test_builtin_positional_only_args(self):
+        spy = Spy(dict)
+        spy.get('key', 1)
+
+        with self.assertRaises(TypeError):
+            spy.get(key='key')
+
+    def test_builtin_signature_is_parsed_once(self):
+        spy = Spy(bytearray)
+        spy.decode('ascii')
+        parsed = PARSED_BUILTINS[bytearray][('decode', True)]
+
+        spy.decode('utf-8', errors='strict')
+        assert_that(PARSED_BUILTINS[bytearray][('decode', True)], same_instance(parsed))
+
 
 class ProxySpyTests(TestCase):
     def test_must_give_argument(self):
@@ -539,6 +607,48 @@ class ProxySpyTests(TestCase):
         assert_that(foo.value, is_(3))
 
 
+class ProxySpyForwardingTests(TestCase):
+    def setUp(self):
+        self.collaborator = Collaborator()
+        self.spy = ProxySpy(self.collaborator)
+
+    def test_resolved_member_is_reused(self):
+        self.spy.one_arg_method(1)
+        member = self.spy._proxy.resolve('one_arg_method')
+
+        self.spy.one_arg_method(2)
+
+        assert_that(self.spy._proxy.resolve('one_arg_method'), is_(member))
+
+    def test_forward_to_method_reassigned_in_instance(self):
+        assert_that(self.spy.hello(), is_("hello"))
+
+        self.collaborator.hello = lambda: "bye"
+
+        assert_that(self.spy.hello(), is_("bye"))
+
+    def test_forward_to_method_reassigned_in_class(self):
+        class Foo(object):
+            def hello(self):
+                return "hello"
+
+        spy = ProxySpy(Foo())
+        assert_that(spy.hello(), is_("hello"))
+
+        Foo.hello = lambda self: "bye"
+
+        assert_that(spy.hello(), is_("bye"))
+
+    def test_forward_property_get(self):
+        collaborator = ObjCollaborator()
+        spy = ProxySpy(collaborator)
+        assert_that(spy.prop, is_(1))
+
+        collaborator.prop = 2
+
+        assert_that(spy.prop, is_(2))
+
+
 class MockTests(TestCase):
     def test_with_args(self):
         mock = Mock()
@@ -672,6 +782,312 @@ class MockOrderTests(TestCase):
 
         assert_that(self.mock, any_order_verify())
 
+    def test_matcher_expectation_may_need_reassignment(self):
+        with self.mock:
+            self.mock.foo(anything())
+            self.mock.foo(1)
+
+        self.mock.foo(1)
+        self.mock.foo(2)
+
+        assert_that(self.mock, any_order_verify())
+
+    def test_equal_values_of_other_type_may_pair_with_literal_expectation(self):
+        with self.mock:
+            self.mock.foo(1)
+            self.mock.foo(instance_of(int))
+
+        self.mock.foo(1.0)
+        self.mock.foo(1)
+
+        assert_that(self.mock, any_order_verify())
+
+    def test_any_order_repeated_call_fails(self):
+        with self.mock:
+            self.mock.foo(1)
+            self.mock.foo(2)
+
+        self.mock.foo(1)
+        self.mock.foo(1)
+
+        with self.assertRaises(AssertionError):
+            assert_that(self.mock, any_order_verify())
+
+    def test_any_order_result_does_not_depend_on_call_order(self):
+        calls = [1, 2, 3, 'a', (4, 5)]
+        for permutation in itertools.permutations(calls):
+            with Mock() as mock:
+                mock.foo(instance_of(str))
+                mock.foo(1)
+                mock.foo(ANY_ARG)
+                mock.foo(anything())
+                mock.foo((4, 5))
+
+            for value in permutation:
+                mock.foo(value)
+
+            assert_that(mock, any_order_verify())
+
+    def test_any_order_10e5_expectations_with_matchers(self):
+        n = 25000
+        with self.mock:
+            for i in range(n):
+                self.mock.send(anything())
+                self.mock.send(instance_of(int))
+                self.mock.send(i)
+                self.mock.send(ANY_ARG)
+
+        for i in reversed(range(n)):
+            self.mock.send(-i - 1)
+            self.mock.send('x')
+            self.mock.send(i)
+            self.mock.send([i])
+
+        start = time.time()
+        assert_that(self.mock, any_order_verify())
+        assert_that(time.time() - start, less_than(10))
+
+    def test_any_order_10e5_expectations_fails(self):
+        n = 25000
+        with self.mock:
+            for i in range(n):
+                self.mock.send(instance_of(int))
+                self.mock.send(i)
+
+        # n + 1 calls for the n instance_of(int) expectations
+        for i in range(n - 1):
+            self.mock.send(i)
+        for i in range(n, 2 * n + 1):
+            self.mock.send(i)
+
+        assert_that(self.mock, is_not(any_order_verify()))
+
+    def test_in_order_calls_do_not_scan_expectations(self):
+        n = 20000
+        with self.mock:
+            for i in range(n):
+                self.mock.send(i).returns(-i)
+
+        start = time.time()
+        for i in range(n):
+            assert_that(self.mock.send(i), is_(-i))
+
+        assert_that(self.mock, verify())
+        assert_that(time.time() - start, less_than(5))
+
+
+class MockFailFastTests(TestCase):
+    def setUp(self):
+        self.mock = Mock()
+        set_fail_fast(self.mock)
+        with self.mock:
+            self.mock.foo(1)
+            self.mock.bar()
+
+    def test_in_order(self):
+        self.mock.foo(1)
+        self.mock.bar()
+
+        assert_that(self.mock, verify())
+
+    def test_out_of_order_call_fails_immediately(self):
+        self.mock.foo(1)
+        try:
+            self.mock.foo(2)
+            self.fail("AssertionError should be raised")
+        except AssertionError as e:
+            assert_that(str(e), string_contains_in_order(
+                "call #2 to be:", "Mock.bar()",
+                "this call was received instead:", "Mock.foo(2)",
+                "after these ones:", "Mock.foo(1)"))
+
+    def test_extra_call_fails_immediately(self):
+        self.mock.foo(1)
+        self.mock.bar()
+
+        with self.assertRaises(AssertionError):
+            self.mock.bar()
+
+    def test_requires_a_mock(self):
+        with self.assertRaises(WrongApiUsage):
+            set_fail_fast(Spy())
+
+
+class MockStreamingVerifyTests(TestCase):
+    def test_missing_calls(self):
+        with Mock() as mock:
+            mock.foo()
+            mock.bar()
+
+        mock.foo()
+
+        with self.assertRaises(AssertionError):
+            assert_that(mock, verify())
+
+    def test_expectations_added_after_invocations(self):
+        mock = Mock()
+        with mock:
+            mock.foo()
+
+        mock.foo()
+        with self.assertRaises(AssertionError):
+            mock.bar()
+
+        with mock:
+            mock.bar()
+
+        mock.bar()
+        assert_that(mock, verify())
+
+    def test_long_in_order_exchange(self):
+        with Mock() as mock:
+            for i in range(300):
+                mock.send(i)
+
+        for i in range(300):
+            mock.send(i)
+
+        assert_that(mock, verify())
+
+
+class MockTimesTests(TestCase):
+    def test_times_is_a_single_expectation(self):
+        with Mock() as mock:
+            mock.send(ANY_ARG).times(3)
+
+        assert_that(len(mock._stubs), is_(1))
+
+    def test_verify(self):
+        with Mock() as mock:
+            mock.hello()
+            mock.send(ANY_ARG).times(3)
+            mock.bye()
+
+        mock.hello()
+        for i in range(3):
+            mock.send(i)
+        mock.bye()
+
+        assert_that(mock, verify())
+
+    def test_verify_fewer_calls(self):
+        with Mock() as mock:
+            mock.send(ANY_ARG).times(3)
+            mock.bye()
+
+        mock.send(1)
+        mock.send(2)
+        mock.bye()
+
+        with self.assertRaises(AssertionError):
+            assert_that(mock, verify())
+
+    def test_any_order_verify(self):
+        with Mock() as mock:
+            mock.send(1).times(2)
+            mock.send(ANY_ARG).times(2)
+
+        mock.send(3)
+        mock.send(1)
+        mock.send(4)
+        mock.send(1)
+
+        assert_that(mock, any_order_verify())
+
+    def test_any_order_verify_too_many_calls(self):
+        with Mock() as mock:
+            mock.send(1).times(2)
+
+        mock.send(1)
+        mock.send(1)
+        with self.assertRaises(AssertionError):
+            mock.bar()
+
+        assert_that(mock, any_order_verify())
+
+    def test_expect_call_times(self):
+        mock = Mock()
+        expect_call(mock).send(ANY_ARG).times(2)
+
+        mock.send(1)
+        mock.send(2)
+
+        assert_that(mock, verify())
+
+    def test_many_times(self):
+        with Mock() as mock:
+            mock.send(ANY_ARG).times(20000)
+
+        for i in range(20000):
+            mock.send(i)
+
+        assert_that(mock, verify())
+        assert_that(mock, any_order_verify())
+
+    def test_show_times(self):
+        with Mock() as mock:
+            mock.send(1).times(2)
+
+        try:
+            assert_that(mock, verify())
+            self.fail("AssertionError should be raised")
+        except AssertionError as e:
+            assert_that(str(e), contains_string("Mock.send(1) -- times: 2"))
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.db = Spy()
+        self.cache = Spy()
+
+    def test_invocations_are_stamped(self):
+        self.db.query(1)
+        self.db.query(2)
+
+        first, second = self.db._recorded
+        assert_that(first.sequence, less_than(second.sequence))
+        assert_that(first.timestamp, is_not(None))
+
+    def test_timeline_merges_doubles(self):
+        self.db.query()
+        self.cache.get()
+        self.db.close()
+
+        names = [i.name for i in timeline(self.db, self.cache)]
+        assert_that(names, is_(['query', 'get', 'close']))
+
+    def test_in_order(self):
+        self.db.query()
+        self.cache.get()
+        self.cache.set()
+
+        assert_that(timeline(self.db, self.cache),
+                    in_order(self.db.query, self.cache.set))
+
+    def test_in_order_fails(self):
+        self.cache.set()
+        self.db.query()
+
+        try:
+            assert_that(timeline(self.db, self.cache),
+                        in_order(self.db.query, self.cache.set))
+            self.fail("AssertionError should be raised")
+        except AssertionError as e:
+            assert_that(str(e), string_contains_in_order(
+                "calls in this order:", "Spy.query", "Spy.set",
+                "calls that actually ocurred were:", "Spy.set()", "Spy.query()"))
+
+    def test_in_order_same_method_several_times(self):
+        self.db.query()
+        self.cache.set()
+
+        assert_that(timeline(self.db, self.cache),
+                    is_not(in_order(self.db.query, self.cache.set, self.db.query)))
+
+    def test_in_order_requires_spy_methods(self):
+        with self.assertRaises(WrongApiUsage):
+            in_order(Stub().foo)
+
 
 class DisplayResultsTests(TestCase):
     def setUp(self):
@@ -1769,57 +2185,1167 @@ class TracerTests(TestCase):
                     is_("ObjCollaborator.prop set to 2"))
 
 
-# new on 1.8.3
-# issue: https://bitbucket.org/DavidVilla/python-doublex/issues/25/support-from-python-35-type-hints-when
-class TypeHintTests(TestCase):
-    def test_returning_type_hint(self):
-        class MyClass:
-            def get_name(self) -> str:
-                return 'a name'
+class BufferedTracerTests(TestCase):
+    def setUp(self):
+        self.out = []
+        self.tracer = BufferedTracer(self.out.append)
 
-        with Stub(MyClass) as my_class:
-            my_class.get_name().returns('another name')
+    def test_nothing_logged_until_flush(self):
+        stub = Stub()
+        self.tracer.trace(stub.foo)
 
+        stub.foo(1, two=2)
 
-# https://bitbucket.org/DavidVilla/python-doublex/issues/24/customize-different-return-values-for
-class function_doubles(TestCase):
-    def test_hack_function_spy(self):
-        with Stub() as stub:
-            method = Method(stub, 'orphan')
-            method("hello").returns("world")
+        assert_that(self.out, is_([]))
+        assert_that(list(self.tracer.lines()), is_(["Stub.foo(1, two=2)"]))
 
-        assert_that(method("hello"), is_("world"))
+    def test_flush_to_logger(self):
+        stub = Stub(ObjCollaborator)
+        self.tracer.trace(stub)
 
-    # TODO
-    # def test_stub_call(self):
-    #     with Stub() as stub:
-    #         stub("hello").returns("world")
+        stub.no_args()
+        stub.prop = 2
+        stub.prop
+        self.tracer.flush()
 
-    #     assert_that(stub("hello"), is_("world"))
+        assert_that(self.out, is_(["ObjCollaborator.no_args()",
+                                   "ObjCollaborator.prop set to 2",
+                                   "ObjCollaborator.prop gotten"]))
+        assert_that(self.tracer.records, is_([]))
 
+    def test_flush_to_file(self):
+        out = StringIO()
+        stub = Stub()
+        self.tracer.trace(stub)
 
-# https://bitbucket.org/DavidVilla/python-doublex/issues/7/doublex-fails-on-methods-where-self-is
-class capture_self(TestCase):
-    def test_capture_self(self):
-        class MyClass:
-            def my_method(*args):
-                pass
+        stub.foo(1)
+        stub.bar('two')
+        self.tracer.flush(out)
 
-        with Spy(MyClass) as spy:
-            spy.my_method('hello').returns(True)
+        assert_that(out.getvalue(), is_("Stub.foo(1)\nStub.bar('two')\n"))
 
 
+class SamplingTracerTests(TestCase):
+    def setUp(self):
+        self.out = []
+        self.tracer = Tracer(self.out.append)
+        self.stub = Stub()
 
-class SomeException(Exception):
-    pass
+    def test_one_in_n(self):
+        self.tracer.trace(self.stub.foo, sampling=OneInN(3))
 
+        for i in range(7):
+            self.stub.foo(i)
 
-class Observer(object):
-    def __init__(self):
-        self.state = None
+        assert_that(self.out, is_(["Stub.foo(2)", "Stub.foo(5)"]))
+        assert_that(self.tracer.skipped(), is_({'Stub.foo': 5}))
 
-    def update(self, *args, **kargs):
-        self.state = args[0]
+    def test_first_then_every(self):
+        self.tracer.trace(self.stub.foo, sampling=FirstThenEvery(2, 3))
+
+        for i in range(9):
+            self.stub.foo(i)
+
+        assert_that(self.out, is_(["Stub.foo(0)", "Stub.foo(1)",
+                                   "Stub.foo(4)", "Stub.foo(7)"]))
+
+    def test_rate_limit(self):
+        self.tracer.trace(self.stub.foo, sampling=RateLimit(2))
+
+        for i in range(100):
+            self.stub.foo(i)
+
+        assert_that(len(self.out), less_than(5))
+        assert_that(self.tracer.skipped()['Stub.foo'], is_(100 - len(self.out)))
+
+    def test_reservoir_traces_samples_on_flush(self):
+        self.tracer.trace(self.stub.foo, sampling=Reservoir(3))
+
+        for i in range(50):
+            self.stub.foo(i)
+
+        assert_that(self.out, is_([]))
+
+        self.tracer.flush()
+        assert_that(len(self.out), is_(3))
+        assert_that(self.tracer.skipped(), is_({'Stub.foo': 47}))
+
+    def test_sampling_is_per_method(self):
+        self.tracer.trace(self.stub, sampling=OneInN(2))
+
+        self.stub.foo()
+        self.stub.bar()
+        self.stub.foo()
+        self.stub.bar()
+
+        assert_that(self.out, is_(["Stub.foo()", "Stub.bar()"]))
+        assert_that(self.tracer.skipped(), is_({'Stub.foo': 1, 'Stub.bar': 1}))
+
+    def test_reservoir_with_buffered_tracer(self):
+        out = []
+        tracer = BufferedTracer(out.append)
+        tracer.trace(self.stub.foo, sampling=Reservoir(2))
+
+        self.stub.foo(1)
+        tracer.flush()
+
+        assert_that(out, is_(["Stub.foo(1)"]))
+
+
+class FlightRecorderTests(TestCase):
+    def setUp(self):
+        self.out = []
+        self.recorder = FlightRecorder(self.out.append, capacity=2)
+        self.spy = Spy()
+        self.recorder.trace(self.spy)
+
+    def test_nothing_logged_while_assertions_pass(self):
+        self.spy.foo(1)
+
+        assert_that(self.spy.foo, called())
+
+        assert_that(self.out, is_([]))
+
+    def test_keeps_last_calls(self):
+        for i in range(5):
+            self.spy.foo(i)
+
+        self.recorder.dump()
+
+        assert_that(self.out, is_(
+            ["last 2 interactions:", "Spy.foo(3)", "Spy.foo(4)"]))
+
+    def test_dumped_on_assertion_failure(self):
+        self.spy.foo(1)
+
+        with self.assertRaises(AssertionError):
+            assert_that(self.spy.bar, called())
+
+        assert_that(self.out, is_(["last 1 interactions:", "Spy.foo(1)"]))
+
+    def test_dumped_on_unexpected_mock_call(self):
+        mock = Mock()
+        self.spy.foo(1)
+
+        with self.assertRaises(AssertionError):
+            mock.foo(2)
+
+        assert_that(self.out, is_(["last 1 interactions:", "Spy.foo(1)"]))
+
+    def test_recorder_lives_while_traced_methods_do(self):
+        out = []
+        FlightRecorder(out.append).trace(self.spy.foo)
+        gc.collect()
+        self.spy.foo(1)
+
+        with self.assertRaises(AssertionError):
+            assert_that(self.spy.bar, called())
+
+        assert_that(out, is_(["last 1 interactions:", "Spy.foo(1)"]))
+
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        profiler.reset()
+        profiler.enable()
+
+    def tearDown(self):
+        profiler.disable()
+        profiler.reset()
+
+    def test_time_is_attributed_to_double_methods(self):
+        spy = Spy(Collaborator)
+        stub = Stub()
+
+        for i in range(3):
+            spy.hello()
+        stub.foo(1)
+
+        entries = dict(((x.double, x.method), x) for x in profiler.report())
+        assert_that(entries[('Collaborator', 'hello')].calls, is_(3))
+        assert_that(entries[('Stub', 'foo')].calls, is_(1))
+
+        hello = entries[('Collaborator', 'hello')]
+        assert_that(hello.recording, greater_than(0))
+        assert_that(hello.signature, greater_than(0))
+        assert_that(hello.dispatch, greater_than(hello.recording))
+
+    def test_properties(self):
+        spy = Spy(ObjCollaborator)
+
+        spy.prop
+        spy.prop = 2
+
+        [entry] = profiler.report()
+        assert_that(entry.method, is_('prop'))
+        assert_that(entry.calls, is_(2))
+
+    def test_collaborator_time_is_not_overhead(self):
+        spy = ProxySpy(Collaborator())
+
+        spy.hello()
+
+        [entry] = profiler.report()
+        assert_that(entry.collaborator, greater_than(0))
+        assert_that(entry.overhead, is_(entry.dispatch - entry.collaborator))
+
+    def test_rank_doubles(self):
+        busy = Spy()
+        idle = Spy()
+
+        idle.foo()
+        for i in range(200):
+            busy.foo(i)
+
+        ranking = profiler.doubles()
+        assert_that(ranking[0][1], is_(200))
+        assert_that(ranking[1][1], is_(1))
+
+    def test_disable_restores_doublex(self):
+        profiler.disable()
+        Stub().foo()
+
+        assert_that(profiler.report(), is_([]))
+        assert_that(hasattr(Method.__call__, '__wrapped__'), is_(False))
+
+    def test_summary(self):
+        Stub(Collaborator).hello()
+
+        assert_that(profiler.summary(), contains_string("Collaborator.hello: 1 calls"))
+
+
+class LazyImportTests(TestCase):
+    def test_lazy_names_match_module_exports(self):
+        import doublex.matchers
+
+        assert_that(doublex._LAZY_MODULES['matchers'],
+                    is_(doublex.matchers.__all__))
+
+    def test_lazy_modules(self):
+        assert_that(doublex.profiler.enable, is_(profiler.enable))
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            doublex.missing
+
+
+class IntrospectionCacheTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = IntrospectionCache(self.directory)
+
+    def populate(self):
+        info = self.cache.info(Collaborator)
+        info.get('kinds', 'hello', lambda: 'method')
+        self.cache.save()
+
+    def test_disabled_by_default(self):
+        assert_that(IntrospectionCache().info(Collaborator), is_(None))
+
+    def test_warm_start(self):
+        self.populate()
+
+        info = IntrospectionCache(self.directory).info(Collaborator)
+        assert_that(info.kinds, is_({'hello': 'method'}))
+        assert_that(info.changed, is_(False))
+
+    def test_stale_file_is_ignored(self):
+        self.populate()
+        fname = self.cache.fname(Collaborator)
+        with open(fname) as fd:
+            data = json.load(fd)
+        data['stamp']['modules'][0][1] -= 1
+        with open(fname, 'w') as fd:
+            json.dump(data, fd)
+
+        info = IntrospectionCache(self.directory).info(Collaborator)
+        assert_that(info.kinds, is_({}))
+
+    def test_modified_base_class_module_is_detected(self):
+        info = self.cache.info(ThreadCollaborator)
+        info.get('kinds', 'run', lambda: 'method')
+        self.cache.save()
+
+        fname = self.cache.fname(ThreadCollaborator)
+        with open(fname) as fd:
+            data = json.load(fd)
+        assert_that(data['stamp']['modules'][1][0], is_(threading.__file__))
+        data['stamp']['modules'][1][1] -= 1
+        with open(fname, 'w') as fd:
+            json.dump(data, fd)
+
+        info = IntrospectionCache(self.directory).info(ThreadCollaborator)
+        assert_that(info.kinds, is_({}))
+
+    def test_unusable_directory_disables_the_cache(self):
+        fname = os.path.join(self.directory, 'file')
+        open(fname, 'w').close()
+
+        cache = IntrospectionCache(os.path.join(fname, 'cache'))
+        assert_that(cache.info(Collaborator), is_(None))
+
+    def test_corrupt_file_is_ignored(self):
+        self.populate()
+        with open(self.cache.fname(Collaborator), 'w') as fd:
+            fd.write('{')
+
+        info = IntrospectionCache(self.directory).info(Collaborator)
+        assert_that(info.kinds, is_({}))
+
+    def test_doubles_use_the_cache(self):
+        set_introspection_cache(self.directory)
+        self.addCleanup(set_introspection_cache,
+                        os.environ.get('DOUBLEX_INTROSPECTION_CACHE'))
+
+        spy = Spy(Collaborator)
+        spy.method_one(1)
+        assert_that(spy.method_one, called().with_some_args(arg1=1))
+
+        from doublex.introspection import CACHE
+        info = CACHE.info(Collaborator)
+        assert_that(info.kinds['method_one'], is_('method'))
+        assert_that(info.argspecs['method_one'].args, is_(['arg1']))
+
+    def test_instance_attributes_are_not_cached(self):
+        set_introspection_cache(self.directory)
+        self.addCleanup(set_introspection_cache,
+                        os.environ.get('DOUBLEX_INTROSPECTION_CACHE'))
+
+        collaborator = Collaborator()
+        collaborator.hello = lambda name: name
+        spy = ProxySpy(collaborator)
+
+        assert_that(spy.hello('bob'), is_('bob'))
+
+        from doublex.introspection import CACHE
+        assert_that(CACHE.info(Collaborator).kinds, is_not(has_key('hello')))
+
+
+class MemoryUsageTests(TestCase):
+    def test_spy_invocations(self):
+        spy = Spy()
+        empty = memory_usage(spy)
+
+        for i in range(10):
+            spy.foo('x' * 1000)
+
+        usage = memory_usage(spy)
+        assert_that(usage.invocations, is_(10))
+        assert_that(usage.stubs, is_(0))
+        assert_that(usage.invocation_bytes, greater_than(empty.invocation_bytes))
+        assert_that(usage.class_bytes, greater_than(0))
+        assert_that(usage.total, is_(sum(usage[2:6])))
+
+    def test_shared_arguments_are_counted_once(self):
+        spy = Spy()
+        big = 'x' * 10000
+
+        spy.foo(big)
+        once = memory_usage(spy).args_bytes
+        spy.foo(big)
+
+        assert_that(memory_usage(spy).args_bytes, less_than(once + 1000))
+        assert_that(once, greater_than(10000))
+
+    def test_stub_return_values(self):
+        with Stub() as stub:
+            stub.foo(1).returns(list(range(1000)))
+
+        usage = memory_usage(stub)
+        assert_that(usage.invocations, is_(0))
+        assert_that(usage.stubs, is_(1))
+        assert_that(usage.retval_bytes, greater_than(8000))
+
+
+class StatsTests(TestCase):
+    def setUp(self):
+        enable_stats()
+        reset_stats()
+
+    def tearDown(self):
+        disable_stats()
+        reset_stats()
+
+    def test_doubles_by_type(self):
+        Stub()
+        Spy(Collaborator)
+        Spy()
+        Mock()
+        Mimic(Spy, Collaborator)
+
+        counters = stats()
+        assert_that(counters['doubles'],
+                    is_({'Stub': 1, 'Spy': 2, 'Mock': 1, 'Mimic': 1}))
+        assert_that(counters['classes_cloned'], is_(5))
+
+    def test_invocations_and_comparisons(self):
+        with Stub() as stub:
+            stub.foo(1).returns(1)
+            stub.foo(2).returns(2)
+
+        reset_stats()
+        stub.foo(2)
+        stub.foo(2)
+
+        counters = stats()
+        assert_that(counters['invocations'], is_(2))
+        assert_that(counters['stub_comparisons'], is_(1))
+        assert_that(counters['matcher_evaluations'], greater_than(0))
+        assert_that(counters['cache_hits'], is_(1))
+        assert_that(counters['cache_misses'], is_(1))
+        assert_that(counters['cache_hit_rate'], is_(0.5))
+
+    def test_signature_introspections(self):
+        spy = Spy(Collaborator)
+
+        spy.hello()
+
+        assert_that(stats()['signature_introspections'], greater_than(0))
+
+    def test_counters_are_merged_from_all_threads(self):
+        spy = Spy()
+        threads = [threading.Thread(target=spy.foo) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert_that(stats()['invocations'], is_(4))
+
+    def test_disabled(self):
+        disable_stats()
+
+        Spy().foo()
+
+        assert_that(stats()['invocations'], is_(0))
+        assert_that(stats()['doubles'], is_({}))
+
+    def test_stats_and_profiler_disabled_in_any_order(self):
+        profiler.enable()
+        disable_stats()
+        Spy().foo()
+        profiler.disable()
+        Spy().foo()
+
+        assert_that(stats()['invocations'], is_(0))
+        assert_that(hasattr(Method.__call__, '__wrapped__'), is_(False))
+        assert_that(hasattr(InvocationContext._assert_values_match, '__wrapped__'),
+                    is_(False))
+        assert_that(profiler.report(), has_length(1))
+        profiler.reset()
+
+
+class JSONLinesTracerTests(TestCase):
+    class BlockingFile(StringIO):
+        def __init__(self):
+            super().__init__()
+            self.release = threading.Event()
+
+        def write(self, text):
+            self.release.wait(5)
+            return super().write(text)
+
+        def close(self):
+            pass
+
+    def events(self, out):
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_method_events(self):
+        out = StringIO()
+        with JSONLinesTracer(out) as tracer:
+            stub = Stub()
+            tracer.trace(stub)
+            with stub:
+                stub.foo(1, key=[2]).returns('three')
+
+            stub.foo(1, key=[2])
+            stub.bar(ObjCollaborator)
+
+        first, second = self.events(out)
+        assert_that(first, has_entry('double', 'Stub'))
+        assert_that(first, has_entry('method', 'foo'))
+        assert_that(first, has_entry('args', [1]))
+        assert_that(first, has_entry('kargs', {'key': [2]}))
+        assert_that(first, has_entry('retval', 'three'))
+        assert_that(first, has_entry('thread', threading.current_thread().name))
+        assert_that(first['sequence'], less_than(second['sequence']))
+        assert_that(second['args'], is_([repr(ObjCollaborator)]))
+
+    def test_property_events(self):
+        out = StringIO()
+        with JSONLinesTracer(out) as tracer:
+            stub = Stub(ObjCollaborator)
+            tracer.trace(stub)
+            stub.prop = 2
+
+        event, = self.events(out)
+        assert_that(event, has_entry('method', 'prop'))
+        assert_that(event, has_entry('args', [2]))
+
+    def test_drop_policy(self):
+        out = self.BlockingFile()
+        tracer = JSONLinesTracer(out, maxsize=1, policy='drop')
+        stub = Stub()
+        tracer.trace(stub)
+
+        for i in range(10):
+            stub.foo(i)
+
+        out.release.set()
+        tracer.close()
+
+        assert_that(tracer.dropped, greater_than(0))
+        assert_that(len(self.events(out)), is_(10 - tracer.dropped))
+
+    def test_wrong_policy(self):
+        with self.assertRaises(WrongApiUsage):
+            JSONLinesTracer(StringIO(), policy='wrong')
+
+    def test_wrong_path_fails_on_creation(self):
+        with self.assertRaises(OSError):
+            JSONLinesTracer('/nonexistent/dir/x.jsonl')
+
+    def test_calls_do_not_block_when_the_writer_fails(self):
+        class BrokenFile(StringIO):
+            def write(self, text):
+                raise IOError("disk full")
+
+        tracer = JSONLinesTracer(BrokenFile(), maxsize=5)
+        stub = Stub()
+        tracer.trace(stub)
+
+        for i in range(20):
+            stub.foo(i)
+
+        tracer.writer.join(5)
+        assert_that(tracer.dropped, greater_than(0))
+        with self.assertRaises(IOError):
+            tracer.close()
+
+
+# new on 1.8.3
+# issue: https://bitbucket.org/DavidVilla/python-doublex/issues/25/support-from-python-35-type-hints-when
+class TypeHintTests(TestCase):
+    def test_returning_type_hint(self):
+        class MyClass:
+            def get_name(self) -> str:
+                return 'a name'
+
+        with Stub(MyClass) as my_class:
+            my_class.get_name().returns('another name')
+
+
+# https://bitbucket.org/DavidVilla/python-doublex/issues/24/customize-different-return-values-for
+class function_doubles(TestCase):
+    def test_hack_function_spy(self):
+        with Stub() as stub:
+            method = Method(stub, 'orphan')
+            method("hello").returns("world")
+
+        assert_that(method("hello"), is_("world"))
+
+    # TODO
+    # def test_stub_call(self):
+    #     with Stub() as stub:
+    #         stub("hello").returns("world")
+
+    #     assert_that(stub("hello"), is_("world"))
+
+
+# https://bitbucket.org/DavidVilla/python-doublex/issues/7/doublex-fails-on-methods-where-self-is
+class capture_self(TestCase):
+    def test_capture_self(self):
+        class MyClass:
+            def my_method(*args):
+                pass
+
+        with Spy(MyClass) as spy:
+            spy.my_method('hello').returns(True)
+
+
+class MethodAliasTests(TestCase):
+    def test_alias_is_the_same_method(self):
+        spy = Spy(Collaborator)
+
+        spy.alias_method(1)
+
+        assert_that(spy.one_arg_method, called().with_args(1))
+        assert_that(spy.hello, is_not(called()))
+
+    def test_method_ids_are_computed_once_per_class(self):
+        spy = Spy(Collaborator)
+        spy.alias_method(1)
+        spy.one_arg_method(2)
+
+        table = METHOD_IDS[Collaborator]
+        assert_that(table.ids['alias_method'], is_(table.ids['one_arg_method']))
+        assert_that(Spy(Collaborator)._proxy.method_id('alias_method'),
+                    is_(table.ids['alias_method']))
+
+    def test_instance_attributes_are_compared_by_value(self):
+        collaborator = Collaborator()
+        collaborator.hello = collaborator.one_arg_method
+        proxy = Spy(collaborator)._proxy
+
+        assert_that(proxy.method_id('hello'), is_(None))
+        assert_that(proxy.same_method('hello', 'one_arg_method'), is_(True))
+
+    def test_any_order_verify_with_aliases(self):
+        with Mock(Collaborator) as mock:
+            mock.one_arg_method(1)
+            mock.hello()
+
+        mock.hello()
+        mock.alias_method(1)
+
+        assert_that(mock, any_order_verify())
+
+    def test_partialmethods_are_different_methods(self):
+        class Register(object):
+            def _set(self, which, value):
+                pass
+
+            set_a = functools.partialmethod(_set, 'a')
+            set_b = functools.partialmethod(_set, 'b')
+
+        spy = Spy(Register)
+        spy.set_a(1)
+
+        assert_that(spy.set_b, never(called()))
+        assert_that(spy.set_a, called().with_args(1))
+
+    def test_builtin_classmethods_are_different_methods(self):
+        spy = Spy(datetime.datetime)
+
+        assert_that(spy._proxy.same_method('now', 'today'), is_(False))
+        assert_that(spy._proxy.same_method('now', 'now'), is_(True))
+
+
+class DispatchCacheTests(TestCase):
+    def test_repeated_invocation_hits_cache(self):
+        with Stub() as stub:
+            stub.get("timeout").returns(10)
+
+        for i in range(3):
+            assert_that(stub.get("timeout"), is_(10))
+
+        assert_that(dispatch_cache_info(stub).hits, is_(2))
+        assert_that(dispatch_cache_info(stub).misses, is_(1))
+
+    def test_not_stubbed_invocations_are_cached_too(self):
+        stub = Stub()
+
+        stub.foo(1)
+        stub.foo(1)
+
+        assert_that(dispatch_cache_info(stub).hits, is_(1))
+
+    def test_new_stubs_invalidate_cache(self):
+        stub = Stub()
+        assert_that(stub.foo(1), is_(None))
+        assert_that(dispatch_cache_info(stub).currsize, is_(1))
+
+        when(stub).foo(1).returns(2)
+
+        assert_that(dispatch_cache_info(stub).currsize, is_(0))
+        assert_that(stub.foo(1), is_(2))
+        assert_that(dispatch_cache_info(stub).misses, is_(2))
+
+    def test_argument_type_is_part_of_the_key(self):
+        with Stub() as stub:
+            stub.foo(instance_of(int)).returns('int')
+
+        assert_that(stub.foo(1), is_('int'))
+        assert_that(stub.foo(1.0), is_(None))
+        assert_that(stub.foo(1), is_('int'))
+        assert_that(stub.foo(1.0), is_(None))
+
+        info = dispatch_cache_info(stub)
+        assert_that((info.hits, info.misses, info.currsize), is_((2, 2, 2)))
+
+    def test_identity_matchers_disable_cache_for_method(self):
+        value = 10 ** 10
+        with Stub() as stub:
+            stub.foo(same_instance(value)).returns('hit')
+            stub.bar(1).returns(2)
+
+        assert_that(stub.foo(int("10000000000")), is_(None))
+        assert_that(stub.foo(value), is_('hit'))
+        assert_that(stub.foo(int("10000000000")), is_(None))
+
+        stub.bar(1)
+        assert_that(dispatch_cache_info(stub).currsize, is_(1))
+
+    def test_cache_size_is_bounded(self):
+        stub = Stub()
+        for i in range(2000):
+            stub.get(i)
+
+        info = dispatch_cache_info(stub)
+        assert_that(info.currsize, is_(info.maxsize))
+
+    def test_unhashable_args_bypass_cache(self):
+        with Stub() as stub:
+            stub.foo([1]).returns(2)
+
+        assert_that(stub.foo([1]), is_(2))
+        assert_that(stub.foo([1]), is_(2))
+
+        assert_that(dispatch_cache_info(stub).currsize, is_(0))
+
+    def test_delegates_are_applied_on_cache_hits(self):
+        with Stub() as stub:
+            stub.foo(1).delegates([1, 2, 3])
+
+        assert_that(stub.foo(1), is_(1))
+        assert_that(stub.foo(1), is_(2))
+
+        assert_that(dispatch_cache_info(stub).hits, is_(1))
+
+    def test_last_matching_stub_wins_over_indexed_ones(self):
+        with Stub() as stub:
+            stub.foo(1).returns('literal')
+            stub.foo(instance_of(int)).returns('matcher')
+            stub.foo(2).returns('two')
+
+        assert_that(stub.foo(1), is_('matcher'))
+        assert_that(stub.foo(2), is_('two'))
+        assert_that(stub.foo(2.0), is_('two'))
+        assert_that(stub.foo(3), is_('matcher'))
+        assert_that(stub.foo('1'), is_(None))
+
+    def test_spy_records_cached_invocations(self):
+        with Spy() as spy:
+            spy.foo(1).returns(2)
+
+        spy.foo(1)
+        spy.foo(1)
+
+        assert_that(spy.foo, called().with_args(1).times(2))
+
+
+class Ambiguous(object):
+    "like numpy arrays, '==' returns something that can not be tested"
+    def __init__(self, values):
+        self.values = values
+
+    def __eq__(self, other):
+        raise ValueError("truth value is ambiguous")
+
+    __hash__ = None
+
+
+class ComparatorTests(TestCase):
+    def tearDown(self):
+        unregister_comparator(Ambiguous)
+        unregister_comparator(bytes)
+
+    def test_same_object_matches_without_comparing(self):
+        value = Ambiguous([1, 2])
+        with Stub() as stub:
+            stub.foo(value).returns(1)
+
+        assert_that(stub.foo(value), is_(1))
+
+    def test_registered_comparator_is_used_by_stubs(self):
+        register_comparator(Ambiguous, lambda a, b: a.values == b.values)
+        with Stub() as stub:
+            stub.foo(Ambiguous([1, 2])).returns(1)
+
+        assert_that(stub.foo(Ambiguous([1, 2])), is_(1))
+        assert_that(stub.foo(Ambiguous([2, 1])), is_(None))
+
+    def test_registered_comparator_is_used_by_verification(self):
+        register_comparator(Ambiguous, lambda a, b: a.values == b.values)
+        spy = Spy(Collaborator)
+        spy.one_arg_method(Ambiguous([1, 2]))
+
+        assert_that(spy.one_arg_method, called().with_args(Ambiguous([1, 2])))
+        assert_that(spy.one_arg_method,
+                    is_not(called().with_args(Ambiguous([3]))))
+
+    def test_comparator_applies_to_subclasses(self):
+        class Derived(Ambiguous):
+            pass
+
+        register_comparator(Ambiguous, lambda a, b: a.values == b.values)
+        spy = Spy()
+        spy.foo(Derived([1]))
+
+        assert_that(spy.foo, called().with_args(Derived([1])))
+
+    def test_registered_types_are_not_cached(self):
+        compared = []
+
+        def compare(a, b):
+            compared.append((a, b))
+            return a == b
+
+        register_comparator(bytes, compare)
+        with Stub() as stub:
+            stub.foo(b'data').returns(1)
+
+        assert_that(stub.foo(bytearray(b'data').decode().encode()), is_(1))
+        assert_that(stub.foo(bytearray(b'data').decode().encode()), is_(1))
+
+        assert_that(dispatch_cache_info(stub).currsize, is_(0))
+        assert_that(compared, has_length(2))
+
+    def test_comparators_registered_later_invalidate_cached_dispatch(self):
+        with Stub() as stub:
+            stub.foo(b'data').returns(1)
+
+        assert_that(stub.foo(b'DATA'), is_(None))
+
+        register_comparator(bytes, lambda a, b: a.lower() == b.lower())
+        assert_that(stub.foo(b'DATA'), is_(1))
+
+        unregister_comparator(bytes)
+        assert_that(stub.foo(b'DATA'), is_(None))
+        assert_that(stub.foo(b'data'), is_(1))
+
+    def test_matchers_take_precedence_over_comparators(self):
+        register_comparator(Ambiguous, lambda a, b: False)
+        with Stub() as stub:
+            stub.foo(instance_of(Ambiguous)).returns(1)
+
+        assert_that(stub.foo(Ambiguous([])), is_(1))
+
+
+class FingerprintTests(TestCase):
+    def setUp(self):
+        self.spy = Spy()
+        set_recording_policy(self.spy, FingerprintPolicy(threshold=100))
+
+    def test_large_arguments_are_recorded_as_fingerprints(self):
+        payload = b'x' * 1000
+        self.spy.write(payload, name='a' * 200, size=1000)
+
+        context = self.spy.write.calls[0]
+        assert_that(context.args[0], instance_of(Fingerprint))
+        assert_that(context.args[0].size, is_(1000))
+        assert_that(context.kargs['name'], instance_of(Fingerprint))
+        assert_that(context.kargs['size'], is_(1000))
+
+    def test_small_arguments_are_kept(self):
+        self.spy.write(b'small', ANY_ARG)
+
+        assert_that(self.spy.write.calls[0].args, is_((b'small', ANY_ARG)))
+
+    def test_verify_with_the_original_value(self):
+        self.spy.write(bytearray(b'x' * 1000))
+
+        assert_that(self.spy.write, called().with_args(bytearray(b'x' * 1000)))
+        assert_that(self.spy.write, is_not(called().with_args(bytearray(b'y' * 1000))))
+        assert_that(self.spy.write, called().with_args(anything()))
+
+    def test_policy_does_not_register_a_comparator(self):
+        from doublex.internal import COMPARATORS
+        FingerprintPolicy()
+
+        assert_that(COMPARATORS.registered, is_not(has_key(Fingerprint)))
+
+    def test_stubs_get_the_original_value(self):
+        payload = b'x' * 1000
+        with self.spy:
+            self.spy.write(ANY_ARG).returns_input()
+
+        assert_that(self.spy.write(payload), same_instance(payload))
+
+    def test_failure_message_shows_fingerprints(self):
+        self.spy.write(b'x' * 1000)
+
+        with self.assertRaises(AssertionError) as e:
+            assert_that(self.spy.write, called().with_args(b'y' * 1000))
+
+        assert_that(str(e.exception), contains_string('<bytes size=1000 blake2b='))
+        assert_that(str(e.exception), is_not(contains_string('yyyy')))
+
+    def test_mock_verifies_fingerprinted_invocations(self):
+        with Mock() as mock:
+            mock.write(b'x' * 1000)
+
+        set_recording_policy(mock, FingerprintPolicy(threshold=100))
+        mock.write(b'x' * 1000)
+
+        assert_that(mock, verify())
+
+    def test_per_method_policy(self):
+        spy = ProxySpy(Collaborator())
+        set_recording_policy(spy.one_arg_method, FingerprintPolicy(threshold=10))
+
+        spy.one_arg_method('a' * 20)
+        spy.varargs('a' * 20)
+
+        assert_that(spy.one_arg_method.calls[0].args[0], instance_of(Fingerprint))
+        assert_that(spy.varargs.calls[0].args[0], is_('a' * 20))
+
+    def test_remove_policy(self):
+        set_recording_policy(self.spy, None)
+
+        self.spy.write(b'x' * 1000)
+
+        assert_that(self.spy.write.calls[0].args[0], is_(b'x' * 1000))
+
+    def test_requires_a_spy(self):
+        with self.assertRaises(WrongApiUsage):
+            set_recording_policy(Stub(), FingerprintPolicy())
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.spy = Spy()
+        set_recording_policy(self.spy, SnapshotPolicy())
+
+    def test_later_changes_do_not_affect_verification(self):
+        values = [1, 2]
+        options = dict(retry=[1])
+
+        self.spy.send(values, options=options)
+        values.append(3)
+        options['retry'].append(2)
+
+        assert_that(self.spy.send, called().with_args([1, 2], options=dict(retry=[1])))
+
+    def test_stubs_and_collaborator_get_the_actual_arguments(self):
+        class Sink(object):
+            def send(self, values):
+                values.append('sent')
+
+        values = []
+        spy = ProxySpy(Sink())
+        set_recording_policy(spy, SnapshotPolicy())
+
+        spy.send(values)
+
+        assert_that(values, is_(['sent']))
+        assert_that(spy.send, called().with_args([]))
+
+    def test_immutable_parts_are_shared(self):
+        label = ('a', (1, 2))
+        self.spy.send([label, [3]])
+
+        recorded = self.spy.send.calls[0].args[0]
+        assert_that(recorded[0], same_instance(label))
+
+    def test_shared_and_recursive_containers(self):
+        inner = [1]
+        outer = [inner, inner]
+        outer.append(outer)
+
+        self.spy.send(outer)
+
+        recorded = self.spy.send.calls[0].args[0]
+        assert_that(recorded[0], same_instance(recorded[1]))
+        assert_that(recorded[2], same_instance(recorded))
+        assert_that(recorded, is_not(same_instance(outer)))
+
+    def test_deepcopy_registered_types(self):
+        class Message(object):
+            def __init__(self, body):
+                self.body = body
+
+        message = Message(['hi'])
+        set_recording_policy(self.spy, SnapshotPolicy(deepcopy_types=[Message]))
+
+        self.spy.send(message, Collaborator())
+        message.body.append('bye')
+
+        recorded = self.spy.send.calls[0].args
+        assert_that(recorded[0].body, is_(['hi']))
+        assert_that(recorded[1], instance_of(Collaborator))
+
+
+class CompactStorageTests(TestCase):
+    def setUp(self):
+        self.spy = Spy()
+        set_recording_storage(self.spy, CompactOperationList())
+
+    def test_repeated_calls_are_stored_once(self):
+        for i in range(1000):
+            self.spy.incr("requests")
+        self.spy.incr("errors")
+
+        assert_that(self.spy.incr, called().with_args("requests").times(1000))
+        assert_that(self.spy.incr, called().times(1001))
+        assert_that(self.spy._recorded.stored(), has_length(2))
+        assert_that(self.spy._recorded, has_length(1001))
+
+    def test_interleaved_calls_keep_their_order(self):
+        for i in range(3):
+            self.spy.incr("a")
+            self.spy.incr("b")
+
+        args = [c.args[0] for c in self.spy.incr.calls]
+        sequences = [i.sequence for i in self.spy._recorded]
+
+        assert_that(args, is_(['a', 'b'] * 3))
+        assert_that(sequences, is_(sorted(sequences)))
+        assert_that(self.spy._recorded.stored(), has_length(2))
+
+    def test_timeline_with_compact_storage(self):
+        other = Spy()
+        self.spy.incr("a")
+        other.get()
+        self.spy.incr("a")
+
+        assert_that([i.name for i in timeline(self.spy, other)],
+                    is_(['incr', 'get', 'incr']))
+
+    def test_different_return_values_are_not_merged(self):
+        with self.spy:
+            self.spy.next().delegates([1, 2])
+
+        self.spy.next()
+        self.spy.next()
+
+        assert_that([c.retval for c in self.spy.next.calls], is_([1, 2]))
+
+    def test_mutable_arguments_are_kept(self):
+        first, second = [1], [1]
+        self.spy.send(first)
+        self.spy.send(second)
+
+        calls = list(self.spy.send.calls)
+        assert_that(calls[0].args[0], same_instance(first))
+        assert_that(calls[1].args[0], same_instance(second))
+
+    def test_calls_recorded_before_are_moved(self):
+        spy = Spy()
+        spy.incr("a")
+        spy.incr("a")
+
+        set_recording_storage(spy, CompactOperationList())
+        spy.incr("a")
+
+        assert_that(spy.incr, called().times(3))
+        assert_that(spy._recorded.stored(), has_length(1))
+
+    def test_failure_message_shows_counts(self):
+        for i in range(5):
+            self.spy.incr("a")
+
+        with self.assertRaises(AssertionError) as e:
+            assert_that(self.spy.incr, called().times(4))
+
+        assert_that(str(e.exception), contains_string("Spy.incr('a') -- times: 5"))
+
+    def test_mock_with_compact_storage(self):
+        with Mock() as mock:
+            mock.incr("a")
+            mock.incr("a")
+            mock.close()
+
+        set_recording_storage(mock, CompactOperationList())
+        mock.incr("a")
+        mock.incr("a")
+        mock.close()
+
+        assert_that(mock, verify())
+
+    def test_requires_a_spy(self):
+        with self.assertRaises(WrongApiUsage):
+            set_recording_storage(Stub(), CompactOperationList())
+
+
+class DiskStorageTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = DiskOperationList(self.directory, segment_size=256)
+        self.spy = Spy(Collaborator)
+        set_recording_storage(self.spy, self.storage)
+
+    def tearDown(self):
+        self.storage.close()
+        os.rmdir(self.directory)
+
+    def test_invocations_are_written_in_segments(self):
+        for i in range(100):
+            self.spy.one_arg_method(i)
+
+        assert_that(self.spy.one_arg_method, called().times(100))
+        assert_that(self.spy.one_arg_method, called().with_args(42))
+        assert_that(len(self.storage.log.paths), greater_than(1))
+        assert_that(self.storage.stored(), has_length(1))
+
+    def test_calls_are_streamed_in_order(self):
+        for i in range(20):
+            self.spy.one_arg_method(i)
+        self.spy.hello()
+
+        calls = self.spy.one_arg_method.calls
+        assert_that([c.args[0] for c in calls], is_(list(range(20))))
+        assert_that(self.spy._recorded[5].context.args, is_((5,)))
+        assert_that(self.spy._recorded[-1].name, is_('hello'))
+
+    def test_calls_and_timeline_are_not_loaded_in_memory(self):
+        for i in range(10):
+            self.spy.one_arg_method(i)
+
+        assert_that(self.spy.one_arg_method.calls, is_not(instance_of(list)))
+        assert_that(timeline(self.spy), is_not(instance_of(list)))
+        assert_that(list(timeline(self.spy)), has_length(10))
+        assert_that(list(timeline(self.spy)), has_length(10))
+
+    def test_return_values_are_recorded(self):
+        with self.spy:
+            self.spy.one_arg_method(1).returns('one')
+
+        self.spy.one_arg_method(1)
+        self.spy.one_arg_method(2)
+
+        assert_that([c.retval for c in self.spy.one_arg_method.calls],
+                    is_(['one', None]))
+
+    def test_unpicklable_invocations_are_kept_in_memory(self):
+        callback = lambda: None
+        self.spy.one_arg_method(callback)
+        self.spy.one_arg_method(2)
+
+        assert_that(self.spy.one_arg_method, called().with_args(callback))
+        assert_that(self.storage.stored(), has_length(2))
+
+    def test_properties_and_timeline(self):
+        spy = Spy(ObjCollaborator)
+        set_recording_storage(spy, DiskOperationList())
+        other = Spy()
+
+        spy.prop = 2
+        other.foo()
+        spy.prop
+
+        assert_that(spy, property_set('prop').to(2))
+        assert_that([i.name for i in timeline(spy, other)],
+                    is_(['prop', 'foo', 'prop']))
+
+    def test_mock_with_disk_storage(self):
+        with Mock() as mock:
+            mock.foo(1)
+            mock.bar()
+
+        set_recording_storage(mock, DiskOperationList(self.directory))
+        mock.foo(1)
+        mock.bar()
+
+        assert_that(mock, verify())
+        mock._recorded.close()
+
+
+class SomeException(Exception):
+    pass
+
+
+class Observer(object):
+    def __init__(self):
+        self.state = None
+
+    def update(self, *args, **kargs):
+        self.state = args[0]
+
+
+class ThreadCollaborator(threading.Thread):
+    pass
 
 
 class ObjCollaborator(object):
@@ -1,7 +1,27 @@
 # -*- coding:utf-8; tab-width:4; mode:python -*-
 
+import copy
+import json
+import queue
+import random
+import threading
+import time
+
 from .doubles import Stub
-from .internal import Method, Property, WrongApiUsage
+from .internal import Method, Property, WrongApiUsage, SEQUENCE
+from .matchers import failure_listeners
+
+
+def format_method_call(method, args, kargs):
+    return str(method._create_invocation(args, kargs))
+
+
+def format_property_access(prop, args, kargs):
+    propname = "%s.%s" % (prop.double._classname(), prop.key)
+    if args:
+        return "%s set to %s" % (propname, args[0])
+
+    return "%s gotten" % propname
 
 
 class MethodTracer(object):
@@ -10,7 +30,7 @@ class MethodTracer(object):
         self.method = method
 
     def __call__(self, *args, **kargs):
-        self.logger(str(self.method._create_invocation(args, kargs)))
+        self.logger(format_method_call(self.method, args, kargs))
 
 
 class PropertyTracer(object):
@@ -19,33 +39,424 @@ class PropertyTracer(object):
         self.prop = prop
 
     def __call__(self, *args, **kargs):
-        propname = "%s.%s" % (self.prop.double._classname(), self.prop.key)
-        if args:
-            self.logger("%s set to %s" % (propname, args[0]))
-        else:
-            self.logger("%s gotten" % (propname))
+        self.logger(format_property_access(self.prop, args, kargs))
+
+
+class Sampler(object):
+    """Base sampling policy. Each traced method or property gets its own
+    copy (see spawn()), so counters and limits are per method."""
+    def __init__(self):
+        self.seen = 0
+        self.emitted = 0
+
+    @property
+    def skipped(self):
+        return self.seen - self.emitted
+
+    def spawn(self):
+        retval = copy.copy(self)
+        retval.seen = retval.emitted = 0
+        return retval
+
+    def __call__(self, hook, args, kargs):
+        self.seen += 1
+        if self.admit():
+            self.emitted += 1
+            hook(*args, **kargs)
+
+    def admit(self):
+        return True
+
+    def flush(self):
+        pass
+
+
+class OneInN(Sampler):
+    "trace a call of every 'n'"
+    def __init__(self, n):
+        super(OneInN, self).__init__()
+        self.n = n
+
+    def admit(self):
+        return not self.seen % self.n
+
+
+class FirstThenEvery(Sampler):
+    "trace the 'first' calls and then one of every 'n'"
+    def __init__(self, first, n):
+        super(FirstThenEvery, self).__init__()
+        self.first = first
+        self.n = n
+
+    def admit(self):
+        return self.seen <= self.first or not (self.seen - self.first) % self.n
+
+
+class RateLimit(Sampler):
+    "trace at most 'per_second' calls each second"
+    def __init__(self, per_second):
+        super(RateLimit, self).__init__()
+        self.per_second = per_second
+        self.window = None
+        self.in_window = 0
+
+    def admit(self):
+        now = int(time.monotonic())
+        if now != self.window:
+            self.window = now
+            self.in_window = 0
+
+        if self.in_window >= self.per_second:
+            return False
+
+        self.in_window += 1
+        return True
+
+
+class Reservoir(Sampler):
+    """keep a uniform random sample of 'size' calls, traced when the tracer
+    is flushed"""
+    def __init__(self, size):
+        super(Reservoir, self).__init__()
+        self.size = size
+        self.samples = []
+
+    def spawn(self):
+        retval = super(Reservoir, self).spawn()
+        retval.samples = []
+        return retval
+
+    def __call__(self, hook, args, kargs):
+        self.seen += 1
+        if len(self.samples) < self.size:
+            self.samples.append((hook, args, kargs))
+            return
+
+        index = random.randrange(self.seen)
+        if index < self.size:
+            self.samples[index] = (hook, args, kargs)
+
+    def flush(self):
+        for hook, args, kargs in self.samples:
+            self.emitted += 1
+            hook(*args, **kargs)
+
+        self.samples = []
+
+
+class SampledHook(object):
+    def __init__(self, sampler, hook):
+        self.sampler = sampler
+        self.hook = hook
+
+    def __call__(self, *args, **kargs):
+        self.sampler(self.hook, args, kargs)
 
 
 class Tracer(object):
     def __init__(self, logger):
         self.logger = logger
+        self.samplers = []
 
-    def trace(self, target):
+    def trace(self, target, sampling=None):
+        """'sampling' is an optional Sampler (OneInN, FirstThenEvery, RateLimit
+        or Reservoir) applied to each traced method or property"""
         if isinstance(target, Method):
-            self.trace_method(target)
+            self.trace_method(target, sampling)
         elif isinstance(target, Stub) or issubclass(target, Stub):
-            self.trace_class(target)
+            self.trace_class(target, sampling)
         else:
             raise WrongApiUsage('Can not trace %s' % target)
 
-    def trace_method(self, method):
-        method.attach(MethodTracer(self.logger, method))
+    def trace_method(self, method, sampling=None):
+        self._attach_sampled(method, repr(method), self.method_tracer(method), sampling)
 
-    def trace_class(self, double):
+    def trace_class(self, double, sampling=None):
         def attach_new_method(attr):
             if isinstance(attr, Method):
-                attr.attach(MethodTracer(self.logger, attr))
+                self._attach_sampled(attr, repr(attr), self.method_tracer(attr), sampling)
             elif isinstance(attr, Property):
-                attr.attach(PropertyTracer(self.logger, attr))
+                name = "%s.%s" % (attr.double._classname(), attr.key)
+                self._attach_sampled(attr, name, self.property_tracer(attr), sampling)
 
         double._new_attr_hooks.append(attach_new_method)
+
+    def _attach_sampled(self, target, name, hook, sampling):
+        if sampling is not None:
+            sampler = sampling.spawn()
+            self.samplers.append((name, sampler))
+            hook = SampledHook(sampler, hook)
+
+        self.attach(target, hook)
+
+    def attach(self, target, hook):
+        target.attach(hook)
+
+    def skipped(self):
+        "how many calls were not traced due to sampling, per method"
+        retval = {}
+        for name, sampler in self.samplers:
+            retval[name] = retval.get(name, 0) + sampler.skipped
+        return retval
+
+    def flush(self):
+        "trace the calls held by samplers (like Reservoir)"
+        for name, sampler in self.samplers:
+            sampler.flush()
+
+    def method_tracer(self, method):
+        return MethodTracer(self.logger, method)
+
+    def property_tracer(self, prop):
+        return PropertyTracer(self.logger, prop)
+
+
+class BufferedMethodTracer(object):
+    def __init__(self, tracer, method):
+        self.tracer = tracer  # keeps it alive while the method is traced
+        self.append = tracer.records.append
+        self.method = method
+
+    def __call__(self, *args, **kargs):
+        self.append((format_method_call, self.method, args, kargs))
+
+
+class BufferedPropertyTracer(BufferedMethodTracer):
+    def __call__(self, *args, **kargs):
+        self.append((format_property_access, self.method, args, kargs))
+
+
+class BufferedTracer(Tracer):
+    """Keep references to traced invocations, formatting them only when
+    read (lines()) or flushed. Arguments are not copied, so they are shown
+    as they are at that moment."""
+
+    def __init__(self, logger=None):
+        super(BufferedTracer, self).__init__(logger)
+        self.records = []
+
+    def method_tracer(self, method):
+        return BufferedMethodTracer(self, method)
+
+    def property_tracer(self, prop):
+        return BufferedPropertyTracer(self, prop)
+
+    def lines(self):
+        for formatter, target, args, kargs in self.records:
+            yield formatter(target, args, kargs)
+
+    def clear(self):
+        self.records.clear()
+
+    def flush(self, out=None):
+        """Send buffered lines to 'out' (the logger by default), which may be
+        a callable taking a line or a writable file"""
+        super(BufferedTracer, self).flush()
+        out = out or self.logger
+        if hasattr(out, 'write'):
+            out.write(str.join('', [line + '\n' for line in self.lines()]))
+        else:
+            for line in self.lines():
+                out(line)
+
+        self.clear()
+
+
+class RingBuffer(object):
+    "preallocated list keeping the last 'capacity' items"
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = [None] * capacity
+        self.count = 0
+
+    def append(self, item):
+        self.items[self.count % self.capacity] = item
+        self.count += 1
+
+    def clear(self):
+        self.items[:] = [None] * self.capacity
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def __iter__(self):
+        for i in range(max(0, self.count - self.capacity), self.count):
+            yield self.items[i % self.capacity]
+
+
+class FlightRecorder(BufferedTracer):
+    """Keep the last 'capacity' traced calls in memory. They are dumped to the
+    logger when a doublex assertion fails or dump() is called."""
+
+    def __init__(self, logger, capacity=5000):
+        super(FlightRecorder, self).__init__(logger)
+        self.records = RingBuffer(capacity)
+        failure_listeners.add(self)
+
+    def assertion_failed(self, exception):
+        self.dump()
+
+    def dump(self, out=None):
+        if not self.records:
+            return
+
+        out = out or self.logger
+        header = "last %s interactions:" % len(self.records)
+        if hasattr(out, 'write'):
+            out.write(header + '\n')
+        else:
+            out(header)
+
+        self.flush(out)
+
+
+def normalize(value):
+    "JSON compatible version of value"
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    if isinstance(value, (list, tuple)):
+        return [normalize(x) for x in value]
+
+    if isinstance(value, dict):
+        return dict((str(k), normalize(v)) for k, v in value.items())
+
+    return repr(value)
+
+
+class StructuredTracer(object):
+    def __init__(self, emit, target, name):
+        self.emit = emit
+        self.target = target
+        self.name = name
+
+    def __call__(self, args, kargs, retval):
+        self.emit((self.target, self.name, args, kargs, retval,
+                   threading.current_thread().name, time.time(), next(SEQUENCE)))
+
+
+class JSONLinesTracer(Tracer):
+    """Write a JSON object per traced call (or property access) to 'out', a
+    path or a writable file. Events are queued and written in batches by a
+    background thread. When the queue is full, 'policy' decides:
+
+    - 'block': the traced call waits for the writer.
+    - 'drop': the event is discarded.
+    - 'sample': once the queue is half full only 1 of each 'sample_rate'
+      events is kept, and events are discarded when it is full.
+
+    Arguments are converted to JSON in the writer thread, so they must not
+    be modified meanwhile. Call close() to write pending events. If the
+    writer fails, events are discarded and close() raises its error.
+    """
+    POLICIES = ('block', 'drop', 'sample')
+    STOP = object()
+
+    def __init__(self, out, maxsize=10000, policy='block', sample_rate=10,
+                 batch_size=500):
+        if policy not in self.POLICIES:
+            raise WrongApiUsage("policy must be one of %s (got '%s' instead)" %
+                                (self.POLICIES, policy))
+
+        super(JSONLinesTracer, self).__init__(None)
+        self.out = open(out, 'a') if isinstance(out, str) else out
+        self.owned = self.out is not out
+        self.maxsize = maxsize
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.received = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize)
+        self.writer = threading.Thread(target=self._write_events, daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attach(self, target, hook):
+        target.attach_result_observer(hook)
+
+    def method_tracer(self, method):
+        return StructuredTracer(self.emit, method.double, method.name)
+
+    def property_tracer(self, prop):
+        return StructuredTracer(self.emit, prop.double, prop.key)
+
+    def emit(self, event):
+        self.received += 1
+        if not self.writer.is_alive():
+            self.dropped += 1
+            return
+
+        if self.policy == 'block':
+            if not self._put(event):
+                self.dropped += 1
+            return
+
+        if self.policy == 'sample' and self.queue.qsize() >= self.maxsize // 2 \
+                and self.received % self.sample_rate:
+            self.dropped += 1
+            return
+
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _put(self, event):
+        "wait for room in the queue while the writer is alive"
+        while self.writer.is_alive():
+            try:
+                self.queue.put(event, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def close(self):
+        if self.writer.is_alive():
+            self.flush()
+            self._put(self.STOP)
+            self.writer.join()
+
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _write_events(self):
+        out = self.out
+        try:
+            stop = False
+            while not stop:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = any(e is self.STOP for e in batch)
+                batch = [e for e in batch if e is not self.STOP]
+
+                out.write(str.join('', [self._format(e) + '\n' for e in batch]))
+                out.flush()
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.owned:
+                out.close()
+
+    @classmethod
+    def _format(cls, event):
+        double, name, args, kargs, retval, thread, timestamp, sequence = event
+        return json.dumps(dict(
+            double=double._classname(), method=name,
+            args=normalize(args), kargs=normalize(kargs), retval=normalize(retval),
+            thread=thread, timestamp=timestamp, sequence=sequence))